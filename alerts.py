@@ -0,0 +1,298 @@
+"""连接事件告警
+
+连接建立/断开事件和远程会话状态切换通过 ``AlertDispatcher.add`` 进入有界队列,
+调用方 (扫描线程) 从不等待网络或子进程。分发线程先在 coalesce_window 秒内合并抖动:
+同一连接 (或会话状态) 在窗口内再次变化时, 两条告警互相抵消, 不会发出。
+窗口结束后的告警分发到每个通知方式各自的队列, 由独立的发送线程按批发送,
+失败时按指数退避重试, 重试耗尽后整批写入磁盘上的死信文件 (JSONL)。
+
+通知方式:
+- webhook: POST JSON ``{"alerts": [...]}`` 到指定 URL
+- syslog: 每条告警发送一行到 /dev/log 或 UDP host:port
+- script: 运行本地程序, 批次 JSON 写入其标准输入
+"""
+import json
+import os
+import queue
+import random
+import socket
+import subprocess
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from datetime import datetime
+
+_EMPTY = object()
+
+
+def describe(alert):
+    """告警的单行文字描述"""
+    if alert['type'] == 'status':
+        return '有外部用户远程连接' if alert.get('is_remote_session') else '没有外部用户远程连接'
+    address = f"{alert.get('remote_ip')}:{alert.get('remote_port')}"
+    if alert['type'] == 'connect':
+        return f"远程连接建立: {address} -> 本地端口 {alert.get('local_port')}"
+    return f"远程连接断开: {address} -> 本地端口 {alert.get('local_port')}, 持续 {alert.get('duration')} 秒"
+
+
+def alert_key(alert):
+    """用于合并抖动的键: 同一连接的建立/断开, 或会话状态"""
+    if alert['type'] == 'status':
+        return ('status',)
+    return ('connection', alert.get('remote_ip'), alert.get('remote_port'), alert.get('local_port'))
+
+
+class WebhookSink:
+    """以 JSON POST 批量发送告警, 非 2xx 响应视为失败"""
+
+    def __init__(self, url, timeout=5.0, headers=None):
+        self.name = f'webhook:{url}'
+        self.url = url
+        self.timeout = timeout
+        self.headers = dict(headers or {})
+
+    def send(self, alerts):
+        body = json.dumps({'alerts': alerts}, ensure_ascii=False).encode('utf-8')
+        request = urllib.request.Request(self.url, data=body, method='POST',
+                                         headers=dict(self.headers, **{'Content-Type': 'application/json'}))
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+class SyslogSink:
+    """每条告警发送一条 syslog 消息; address 为 unix 套接字路径或 host:port (UDP)"""
+
+    def __init__(self, address='/dev/log', facility=1, severity=5, tag='whoishere'):
+        self.name = f'syslog:{address}'
+        if address.startswith('/'):
+            self.family, self.address = socket.AF_UNIX, address
+        else:
+            host, _, port = address.rpartition(':')
+            self.family, self.address = socket.AF_INET, (host.strip('[]') or 'localhost', int(port or 514))
+            if ':' in self.address[0]:
+                self.family = socket.AF_INET6
+        self.priority = facility * 8 + severity
+        self.tag = tag
+
+    def send(self, alerts):
+        with socket.socket(self.family, socket.SOCK_DGRAM) as sock:
+            for alert in alerts:
+                message = f'<{self.priority}>{self.tag}: {describe(alert)}'
+                sock.sendto(message.encode('utf-8'), self.address)
+
+
+class ScriptSink:
+    """运行本地程序, 批次 JSON 写入标准输入; 退出码非0或超时视为失败"""
+
+    def __init__(self, command, timeout=30.0):
+        self.command = command if isinstance(command, list) else [command]
+        self.name = f'script:{self.command[0]}'
+        self.timeout = timeout
+
+    def send(self, alerts):
+        result = subprocess.run(self.command, input=json.dumps({'alerts': alerts}, ensure_ascii=False),
+                                capture_output=True, text=True, timeout=self.timeout)
+        if result.returncode != 0:
+            raise RuntimeError(f'退出码 {result.returncode}: {result.stderr.strip()[:200]}')
+
+
+SINK_TYPES = {
+    'webhook': lambda item: WebhookSink(item['url'], item.get('timeout', 5.0), item.get('headers')),
+    'syslog': lambda item: SyslogSink(item.get('address', '/dev/log'), item.get('facility', 1),
+                                      item.get('severity', 5), item.get('tag', 'whoishere')),
+    'script': lambda item: ScriptSink(item['command'], item.get('timeout', 30.0)),
+}
+
+
+class AlertDispatcher:
+    """告警分发: 有界队列 -> 合并抖动 -> 各通知方式的发送线程 (批量、重试、死信)"""
+
+    def __init__(self, sinks, coalesce_window=5.0, batch_size=50, flush_interval=1.0,
+                 max_attempts=5, retry_base=1.0, retry_max=60.0, spool_path=None, queue_size=10000):
+        self.sinks = list(sinks)
+        self.coalesce_window = coalesce_window
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max(1, max_attempts)
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.spool_path = spool_path
+        self.hostname = socket.gethostname()
+        self.stats = {'received': 0, 'dropped': 0, 'coalesced': 0, 'delivered': 0,
+                      'retries': 0, 'dead_lettered': 0}
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._pending = OrderedDict()
+        self._closing = threading.Event()
+        self._spool_lock = threading.Lock()
+        # stats 由调用方、分发线程和各发送线程共同更新
+        self._stats_lock = threading.Lock()
+        self._outboxes = [(sink, queue.Queue(maxsize=queue_size)) for sink in self.sinks]
+
+        self._collector = threading.Thread(target=self._collect_loop, name='alert-collector', daemon=True)
+        self._collector.start()
+        self._workers = []
+        for sink, outbox in self._outboxes:
+            worker = threading.Thread(target=self._deliver_loop, args=(sink, outbox),
+                                      name=f'alert-{sink.name}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def add(self, event):
+        """提交一个连接事件或状态事件, 不阻塞调用方; 队列满时丢弃并计数"""
+        alert = dict(event, host=self.hostname, alert_time=datetime.now().isoformat())
+        try:
+            self._queue.put_nowait(alert)
+            self._count('received', 1)
+        except queue.Full:
+            self._count('dropped', 1)
+
+    def close(self):
+        """发出所有等待合并的告警, 发送完已排队的批次 (不再重试) 后停止所有线程"""
+        self._queue.put(None)
+        self._collector.join()
+        self._closing.set()
+        for worker in self._workers:
+            worker.join()
+
+    def _count(self, name, amount):
+        with self._stats_lock:
+            self.stats[name] += amount
+
+    def view(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        return {
+            'sinks': [sink.name for sink in self.sinks],
+            'pending': len(self._pending),
+            'queued': self._queue.qsize(),
+            'coalesce_window': self.coalesce_window,
+            'spool': self.spool_path,
+            **stats,
+        }
+
+    # ---- 合并抖动 ----
+    def _collect_loop(self):
+        while True:
+            timeout = None
+            if self._pending:
+                due = next(iter(self._pending.values()))[0]
+                timeout = max(0.0, due - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = _EMPTY
+            if item is None:
+                self._release(float('inf'))
+                break
+            if item is not _EMPTY:
+                self._coalesce(item)
+            self._release(time.monotonic())
+        for _, outbox in self._outboxes:
+            outbox.put(None)
+
+    def _coalesce(self, alert):
+        """窗口内同一个键再次变化 (连接建立后很快断开、状态切换后又切回) 时两条都不发送"""
+        key = alert_key(alert)
+        if key in self._pending:
+            del self._pending[key]
+            self._count('coalesced', 2)
+            return
+        self._pending[key] = (time.monotonic() + self.coalesce_window, alert)
+
+    def _release(self, now):
+        """发出合并窗口已结束的告警 (等待队列按到达顺序排列, 截止时间也是递增的)"""
+        while self._pending:
+            key, (due, alert) = next(iter(self._pending.items()))
+            if due > now:
+                break
+            del self._pending[key]
+            for sink, outbox in self._outboxes:
+                try:
+                    outbox.put_nowait(alert)
+                except queue.Full:
+                    self._spool(sink, [alert], '发送队列已满')
+
+    # ---- 发送 ----
+    def _next_batch(self, outbox):
+        """阻塞等待第一条告警, 再在 flush_interval 内尽量凑满一批; 返回 (批次, 是否继续)"""
+        batch = []
+        item = outbox.get()
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            if item is None:
+                return batch, False
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                return batch, True
+            try:
+                item = outbox.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                return batch, True
+
+    def _deliver_loop(self, sink, outbox):
+        running = True
+        while running:
+            batch, running = self._next_batch(outbox)
+            if batch:
+                self._deliver(sink, batch)
+
+    def _deliver(self, sink, batch):
+        """发送一批告警, 失败时指数退避重试 (带随机抖动), 重试耗尽或正在停止时写入死信文件"""
+        error = None
+        for attempt in range(self.max_attempts):
+            try:
+                sink.send(batch)
+            except Exception as e:
+                error = str(e) or e.__class__.__name__
+            else:
+                self._count('delivered', len(batch))
+                return
+            if attempt + 1 >= self.max_attempts or self._closing.is_set():
+                break
+            self._count('retries', 1)
+            delay = min(self.retry_max, self.retry_base * (2 ** attempt)) * random.uniform(0.8, 1.2)
+            if self._closing.wait(delay):
+                break
+        print(f"告警发送失败 ({sink.name}): {error}")
+        self._spool(sink, batch, error)
+
+    def _spool(self, sink, alerts, error):
+        """把发送失败的告警追加到死信文件, 便于之后补发"""
+        self._count('dead_lettered', len(alerts))
+        if not self.spool_path:
+            return
+        record = {'sink': sink.name, 'error': error, 'failed_at': datetime.now().isoformat(), 'alerts': alerts}
+        try:
+            with self._spool_lock, open(self.spool_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        except OSError as e:
+            print(f"写入告警死信文件出错: {e}")
+
+
+def load_alerts(path):
+    """从 JSON 文件读取告警配置并创建分发器, 格式见 alerts.example.json
+
+    死信文件的相对路径相对于配置文件所在目录。
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    spool = config.get('spool')
+    if spool:
+        spool = os.path.join(os.path.dirname(os.path.abspath(path)), spool)
+    sinks = []
+    for item in config.get('sinks', []):
+        factory = SINK_TYPES.get(item.get('type'))
+        if factory is None:
+            raise ValueError(f"未知的告警方式: {item.get('type')}")
+        sinks.append(factory(item))
+    return AlertDispatcher(
+        sinks,
+        coalesce_window=config.get('coalesce_seconds', 5.0),
+        batch_size=config.get('batch_size', 50),
+        flush_interval=config.get('flush_seconds', 1.0),
+        max_attempts=config.get('max_attempts', 5),
+        retry_base=config.get('retry_base_seconds', 1.0),
+        retry_max=config.get('retry_max_seconds', 60.0),
+        spool_path=spool,
+    )
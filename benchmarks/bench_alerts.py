@@ -0,0 +1,121 @@
+"""告警分发基准测试
+
+在回环端口上启动一个 HTTP 桩接收端 (可设置响应延迟和失败比例), 向 ``AlertDispatcher``
+提交大量连接事件 (其中一部分是很快断开的抖动连接), 测量:
+
+- 提交一条事件的耗时 (扫描线程实际承担的开销)
+- 全部告警送达所需时间、接收端收到的批次数
+- 合并掉的抖动告警数、重试次数和写入死信文件的告警数
+
+    python benchmarks/bench_alerts.py --events 10000 --delay 0.2 --fail-rate 0.3
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from alerts import AlertDispatcher, WebhookSink  # noqa: E402
+
+
+class Receiver(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, delay, fail_rate):
+        self.delay = delay
+        self.fail_rate = fail_rate
+        self.batches = 0
+        self.alerts = 0
+        self.failures = 0
+        self.lock = threading.Lock()
+        self.rng = random.Random(1)
+        super().__init__(('127.0.0.1', 0), Handler)
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        server = self.server
+        time.sleep(server.delay)
+        with server.lock:
+            failed = server.rng.random() < server.fail_rate
+            if failed:
+                server.failures += 1
+            else:
+                server.batches += 1
+                server.alerts += len(json.loads(body)['alerts'])
+        self.send_response(503 if failed else 200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=10000, help='连接建立事件数')
+    parser.add_argument('--flap-ratio', type=float, default=0.2, help='很快断开 (应被合并) 的连接比例')
+    parser.add_argument('--delay', type=float, default=0.2, help='接收端每个请求的延迟(秒)')
+    parser.add_argument('--fail-rate', type=float, default=0.3, help='接收端返回 503 的比例')
+    parser.add_argument('--coalesce', type=float, default=0.5, help='合并窗口(秒)')
+    args = parser.parse_args()
+
+    receiver = Receiver(args.delay, args.fail_rate)
+    threading.Thread(target=receiver.serve_forever, daemon=True).start()
+    spool = os.path.join(tempfile.mkdtemp(), 'dead.jsonl')
+    sink = WebhookSink(f'http://127.0.0.1:{receiver.server_port}/alerts', timeout=5)
+    dispatcher = AlertDispatcher([sink], coalesce_window=args.coalesce, batch_size=100, flush_interval=0.2,
+                                 max_attempts=4, retry_base=0.05, retry_max=1.0, spool_path=spool)
+
+    rng = random.Random(2)
+    samples = []
+    expected = 0
+    start = time.perf_counter()
+    for i in range(args.events):
+        event = {'type': 'connect', 'remote_ip': f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}',
+                 'remote_port': 40000 + i % 20000, 'local_port': 43389, 'start_ts': time.time()}
+        t0 = time.perf_counter()
+        dispatcher.add(event)
+        if rng.random() < args.flap_ratio:
+            dispatcher.add(dict(event, type='disconnect', duration=0.1))
+        else:
+            expected += 1
+        samples.append(time.perf_counter() - t0)
+    submitted = time.perf_counter() - start
+
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        stats = dispatcher.view()
+        if stats['queued'] == 0 and stats['pending'] == 0 and \
+                stats['delivered'] + stats['dead_lettered'] >= expected:
+            break
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - start
+    dispatcher.close()
+    receiver.shutdown()
+
+    ordered = sorted(samples)
+    print(json.dumps({
+        'events': args.events,
+        'expected_alerts': expected,
+        'submit_median_us': round(statistics.median(ordered) * 1e6, 2),
+        'submit_p99_us': round(ordered[int(len(ordered) * 0.99)] * 1e6, 2),
+        'submit_total_ms': round(submitted * 1000, 1),
+        'drain_seconds': round(elapsed, 2),
+        'received_alerts': receiver.alerts,
+        'received_batches': receiver.batches,
+        'receiver_failures': receiver.failures,
+        **{k: v for k, v in dispatcher.view().items() if isinstance(v, int) and not isinstance(v, bool)},
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
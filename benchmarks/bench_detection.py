@@ -0,0 +1,244 @@
+"""检测与接口热路径基准测试
+
+生成合成的 ``netstat -ano`` 输出和 ``/proc/net/tcp`` 表 (1k ~ 200k 个套接字,
+不同的命中比例), 测量:
+
+- 解析吞吐量 (行/秒)
+- 完整扫描延迟 (解析 + 规则匹配 + 生成用户信息)
+- 单次扫描的内存峰值 (tracemalloc)
+- 并发客户端下 ``/api/status`` 的端到端延迟
+
+结果以 JSON 输出, 便于比较不同版本:
+    python benchmarks/bench_detection.py --output results.json
+    python benchmarks/bench_detection.py --sizes 1000,10000 --ratios 0.01 --clients 8
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from netscan import NetstatScanner, ProcNetScanner  # noqa: E402
+
+RDP_PORT = 43389
+STATES = ('ESTABLISHED',)
+BACKGROUND_STATES = ('ESTABLISHED', 'TIME_WAIT', 'CLOSE_WAIT', 'LISTEN')
+PROC_STATE_CODES = {'ESTABLISHED': '01', 'TIME_WAIT': '06', 'CLOSE_WAIT': '08', 'LISTEN': '0A'}
+
+
+def _random_rows(count, ratio, seed):
+    """生成 (本地IP, 本地端口, 远程IP, 远程端口, 状态, pid) 行, 约 ratio 比例命中 43389"""
+    rng = random.Random(seed)
+    rows = []
+    for i in range(count):
+        local_ip = f'10.0.{rng.randrange(256)}.{rng.randrange(1, 255)}'
+        remote_ip = f'172.16.{rng.randrange(256)}.{rng.randrange(1, 255)}'
+        if rng.random() < ratio:
+            rows.append((local_ip, RDP_PORT, remote_ip, rng.randrange(1024, 65535), 'ESTABLISHED', 4000 + i % 50))
+        else:
+            local_port = rng.randrange(1024, 65535)
+            if local_port == RDP_PORT:
+                local_port += 1
+            rows.append((local_ip, local_port, remote_ip, rng.choice((80, 443, 8080, 3306)),
+                         rng.choice(BACKGROUND_STATES), 1000 + i % 500))
+    return rows
+
+
+def make_netstat_text(rows):
+    """Windows 格式的 netstat -ano 输出"""
+    lines = ['', '活动连接', '', '  协议  本地地址          外部地址        状态           PID']
+    for local_ip, local_port, remote_ip, remote_port, state, pid in rows:
+        state = 'LISTENING' if state == 'LISTEN' else state
+        lines.append(f'  TCP    {local_ip}:{local_port:<6} {remote_ip}:{remote_port:<6} {state:<15} {pid}')
+    return '\n'.join(lines) + '\n'
+
+
+def _proc_hex_ip(ip):
+    return ''.join(f'{int(part):02X}' for part in reversed(ip.split('.')))
+
+
+def make_proc_text(rows):
+    """/proc/net/tcp 格式的连接表"""
+    lines = ['  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode']
+    for i, (local_ip, local_port, remote_ip, remote_port, state, _) in enumerate(rows):
+        lines.append(
+            f'{i:4d}: {_proc_hex_ip(local_ip)}:{local_port:04X} {_proc_hex_ip(remote_ip)}:{remote_port:04X} '
+            f'{PROC_STATE_CODES[state]} 00000000:00000000 00:00000000 00000000  1000        0 {100000 + i} '
+            '1 0000000000000000 20 4 30 10 -1'
+        )
+    return '\n'.join(lines) + '\n'
+
+
+class SyntheticScanner:
+    """解析预先生成的文本, 模拟一个扫描后端 (不补全 pid, 避免访问真实进程)"""
+
+    def __init__(self, name, text):
+        self.name = name
+        self.text = text
+        self.last_parsed = text.count('\n')
+
+    def scan(self, ports, states):
+        if self.name == 'netstat':
+            return [c._replace(pid=None) for c in NetstatScanner.parse(self.text, ports, states)]
+        return [conn for conn, _ in ProcNetScanner.parse(self.text, ports, states)]
+
+
+def _timed(func, repeat):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        samples.append(time.perf_counter() - start)
+    return result, samples
+
+
+def _summary_ms(samples):
+    ordered = sorted(samples)
+    return {
+        'median_ms': round(statistics.median(ordered) * 1000, 3),
+        'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3),
+        'min_ms': round(ordered[0] * 1000, 3),
+    }
+
+
+def bench_parsers(main, sizes, ratios, repeat):
+    results = []
+    for size in sizes:
+        for ratio in ratios:
+            rows = _random_rows(size, ratio, seed=size)
+            for backend, text in (('netstat', make_netstat_text(rows)), ('proc', make_proc_text(rows))):
+                if backend == 'netstat':
+                    parse = lambda: NetstatScanner.parse(text, {RDP_PORT}, STATES)  # noqa: E731
+                else:
+                    parse = lambda: ProcNetScanner.parse(text, {RDP_PORT}, STATES)  # noqa: E731
+                matched, parse_samples = _timed(parse, repeat)
+
+                detector = main.RemoteDesktopDetector([SyntheticScanner(backend, text)])
+                _, scan_samples = _timed(detector.get_remote_desktop_users, repeat)
+
+                tracemalloc.start()
+                detector.get_remote_desktop_users()
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+                parse_median = statistics.median(parse_samples)
+                result = {
+                    'backend': backend,
+                    'sockets': size,
+                    'match_ratio': ratio,
+                    'matched': len(matched),
+                    'parse': dict(_summary_ms(parse_samples),
+                                  lines_per_sec=round(size / parse_median) if parse_median else None),
+                    'scan': _summary_ms(scan_samples),
+                    'scan_peak_memory_kb': round(peak / 1024, 1),
+                }
+                results.append(result)
+                print(f"{backend:8s} {size:>7d} sockets ratio {ratio:<6} "
+                      f"parse {result['parse']['median_ms']:9.3f} ms  scan {result['scan']['median_ms']:9.3f} ms  "
+                      f"peak {result['scan_peak_memory_kb']:9.1f} KB", file=sys.stderr)
+    return results
+
+
+def bench_api(main, size, ratio, clients, duration):
+    """并发客户端通过 HTTP 长连接请求 /api/status"""
+    from werkzeug.serving import make_server
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    rows = _random_rows(size, ratio, seed=size)
+    main.detector = main.RemoteDesktopDetector([SyntheticScanner('proc', make_proc_text(rows))])
+    main.detector.refresh_snapshot()
+
+    server = make_server('127.0.0.1', 0, main.app, threaded=True)
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+    port = server.server_port
+
+    latencies = [[] for _ in range(clients)]
+    errors = [0] * clients
+    deadline = time.perf_counter() + duration
+
+    def client(index):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                conn.request('GET', '/api/status')
+                response = conn.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException):
+                errors[index] += 1
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+                continue
+            latencies[index].append(time.perf_counter() - start)
+        conn.close()
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    server.shutdown()
+
+    samples = [s for per_client in latencies for s in per_client]
+    result = {
+        'clients': clients,
+        'sockets': size,
+        'match_ratio': ratio,
+        'requests': len(samples),
+        'errors': sum(errors),
+        'requests_per_sec': round(len(samples) / duration, 1),
+    }
+    if samples:
+        ordered = sorted(samples)
+        result.update(_summary_ms(samples))
+        result['p99_ms'] = round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 3)
+    print(f"/api/status {clients} clients: {result['requests_per_sec']} req/s  "
+          f"median {result.get('median_ms')} ms  p99 {result.get('p99_ms')} ms", file=sys.stderr)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,10000,50000,200000', help='套接字数量列表')
+    parser.add_argument('--ratios', default='0.001,0.01,0.1', help='命中比例列表')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--clients', type=int, default=16, help='/api/status 并发客户端数, 0 表示跳过')
+    parser.add_argument('--duration', type=float, default=5.0, help='/api/status 压测时长(秒)')
+    parser.add_argument('--output', help='结果写入 JSON 文件, 默认输出到标准输出')
+    args = parser.parse_args()
+
+    import main as whoishere
+
+    sizes = [int(s) for s in args.sizes.split(',')]
+    ratios = [float(r) for r in args.ratios.split(',')]
+    report = {
+        'timestamp': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parsers': bench_parsers(whoishere, sizes, ratios, args.repeat),
+    }
+    if args.clients:
+        report['api_status'] = bench_api(whoishere, sizes[-1], ratios[0], args.clients, args.duration)
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
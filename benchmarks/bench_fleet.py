@@ -0,0 +1,109 @@
+"""集群汇总模式基准测试
+
+在子进程中启动 N 个回环端口上的桩代理 (返回固定的 /api/status JSON,
+支持 HTTP/1.1 长连接), 然后测量 FleetCollector 每轮轮询全部代理的耗时。
+
+用法:
+    python benchmarks/bench_fleet.py --agents 1000 --rounds 10
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fleet import FleetCollector  # noqa: E402
+
+STUB_STATUS = json.dumps({
+    'is_remote_session': True,
+    'last_check_time': '2026-01-01T00:00:00',
+    'remote_users': [{'remote_ip': '10.0.0.2', 'remote_address': '10.0.0.2:50000'}],
+    'user_count': 1,
+}).encode()
+
+
+def _raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+async def _handle(reader, writer):
+    try:
+        while True:
+            request = await reader.readuntil(b'\r\n\r\n')
+            if not request:
+                break
+            writer.write(
+                b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                b'Content-Length: ' + str(len(STUB_STATUS)).encode() + b'\r\n\r\n' + STUB_STATUS
+            )
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    writer.close()
+
+
+def run_stub_agents(count, conn):
+    """启动 count 个桩代理, 通过管道返回端口列表, 收到任意消息后退出"""
+    _raise_fd_limit()
+
+    async def main():
+        servers = [await asyncio.start_server(_handle, '127.0.0.1', 0) for _ in range(count)]
+        conn.send([s.sockets[0].getsockname()[1] for s in servers])
+        await asyncio.get_running_loop().run_in_executor(None, conn.recv)
+        for server in servers:
+            server.close()
+
+    asyncio.run(main())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--agents', type=int, default=1000)
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--json', dest='json_path', help='结果写入 JSON 文件')
+    args = parser.parse_args()
+
+    _raise_fd_limit()
+    parent, child = multiprocessing.Pipe()
+    stub = multiprocessing.Process(target=run_stub_agents, args=(args.agents, child), daemon=True)
+    stub.start()
+    ports = parent.recv()
+
+    collector = FleetCollector([('127.0.0.1', port) for port in ports], timeout=5.0)
+    durations = []
+
+    async def rounds():
+        for _ in range(args.rounds):
+            await collector.poll_once()
+            durations.append(collector.last_round_duration * 1000)
+        for agent in collector.agents:
+            agent.connection.close()
+
+    try:
+        asyncio.run(rounds())
+    finally:
+        parent.send('stop')
+        stub.join()
+
+    view = collector.view()
+    result = {
+        'agents': args.agents,
+        'online': view['online_count'],
+        'first_round_ms': round(durations[0], 2),
+        'median_round_ms': round(statistics.median(durations[1:] or durations), 2),
+        'max_round_ms': round(max(durations[1:] or durations), 2),
+    }
+    print(json.dumps(result, indent=2))
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
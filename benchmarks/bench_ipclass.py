@@ -0,0 +1,92 @@
+"""IP分类基准测试
+
+生成随机且互不相同的 CIDR 列表 (默认 50k 个网段, 分属多个标签, 含嵌套网段), 测量:
+
+- 从标签目录加载并构建区间表的耗时
+- 区间表 (二分查找) 的单次查询耗时
+- 逐个网段线性匹配的单次查询耗时 (作为对照, 只测少量地址)
+
+    python benchmarks/bench_ipclass.py --prefixes 50000 --lookups 100000
+"""
+import argparse
+import ipaddress
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ipclass import IpClassifier  # noqa: E402
+
+LABELS = ('vpn', 'office', 'vendor')
+
+
+def write_label_files(directory, count, seed):
+    rng = random.Random(seed)
+    networks = []
+    seen = set()
+    files = {label: open(os.path.join(directory, f'{label}.txt'), 'w', encoding='utf-8') for label in LABELS}
+    for _ in range(count):
+        if rng.random() < 0.9:
+            network = ipaddress.ip_network((rng.randrange(2 ** 32), rng.randrange(12, 33)), strict=False)
+        else:
+            network = ipaddress.ip_network((rng.randrange(2 ** 128), rng.randrange(32, 129)), strict=False)
+        if network in seen:
+            continue
+        seen.add(network)
+        label = rng.choice(LABELS)
+        files[label].write(f'{network}\n')
+        networks.append((network, label))
+    for f in files.values():
+        f.close()
+    return networks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--prefixes', type=int, default=50000)
+    parser.add_argument('--lookups', type=int, default=100000)
+    parser.add_argument('--linear-lookups', type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory() as directory:
+        networks = write_label_files(directory, args.prefixes, seed=args.prefixes)
+        start = time.perf_counter()
+        classifier = IpClassifier(directory)
+        build = time.perf_counter() - start
+
+    addresses = [ipaddress.ip_address(rng.randrange(2 ** 32)) for _ in range(args.lookups)]
+    start = time.perf_counter()
+    for address in addresses:
+        classifier.classify(address)
+    indexed = (time.perf_counter() - start) / len(addresses)
+
+    def linear(address):
+        best = None
+        for network, label in networks:
+            if network.version == address.version and address in network:
+                if best is None or network.prefixlen > best[0].prefixlen:
+                    best = (network, label)
+        return best[1] if best else 'unknown'
+
+    sample = addresses[:args.linear_lookups]
+    start = time.perf_counter()
+    for address in sample:
+        assert linear(address) == classifier.classify(address)
+    scanned = (time.perf_counter() - start) / len(sample)
+
+    print(json.dumps({
+        'prefixes': args.prefixes,
+        'intervals': classifier.index.size,
+        'build_ms': round(build * 1000, 1),
+        'indexed_lookup_us': round(indexed * 1e6, 3),
+        'linear_lookup_us': round(scanned * 1e6, 1),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
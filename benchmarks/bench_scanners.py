@@ -0,0 +1,124 @@
+"""扫描后端基准测试
+
+在本机建立大量回环 TCP 连接 (默认 50000 个套接字) 和少量 43389 端口连接,
+比较各扫描后端单次扫描的耗时。
+
+用法:
+    python benchmarks/bench_scanners.py --sockets 50000 --matches 10
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import socket
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from netscan import SCANNER_TYPES  # noqa: E402
+
+RDP_PORT = 43389
+# 每个子进程持有的连接对数, 受文件描述符上限约束
+PAIRS_PER_PROCESS = 8000
+
+
+def _raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+def _open_pairs(count, port=0):
+    """在回环地址上建立 count 对已连接的套接字"""
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', port))
+    listener.listen(1024)
+    address = listener.getsockname()
+    held = [listener]
+    for _ in range(count):
+        client = socket.create_connection(address)
+        server, _ = listener.accept()
+        held.extend((client, server))
+    return held
+
+
+def _hold_connections(count, ready, stop):
+    _raise_fd_limit()
+    held = _open_pairs(count)
+    ready.set()
+    stop.wait()
+    for sock in held:
+        sock.close()
+
+
+def time_scanner(scanner, repeat):
+    ports = {RDP_PORT}
+    states = ('ESTABLISHED',)
+    matched = len(scanner.scan(ports, states))
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        scanner.scan(ports, states)
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        'backend': scanner.name,
+        'matched': matched,
+        'median_ms': round(statistics.median(samples), 3),
+        'min_ms': round(min(samples), 3),
+        'max_ms': round(max(samples), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sockets', type=int, default=50000, help='背景套接字数量')
+    parser.add_argument('--matches', type=int, default=10, help='43389 端口连接对数')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--backends', default='netlink,proc,psutil,netstat')
+    parser.add_argument('--json', dest='json_path', help='结果写入 JSON 文件')
+    args = parser.parse_args()
+
+    _raise_fd_limit()
+    stop = multiprocessing.Event()
+    workers = []
+    remaining = args.sockets // 2
+    while remaining > 0:
+        count = min(PAIRS_PER_PROCESS, remaining)
+        ready = multiprocessing.Event()
+        proc = multiprocessing.Process(target=_hold_connections, args=(count, ready, stop), daemon=True)
+        proc.start()
+        workers.append((proc, ready))
+        remaining -= count
+    for proc, ready in workers:
+        ready.wait()
+    held = _open_pairs(args.matches, RDP_PORT)
+
+    results = []
+    try:
+        for name in args.backends.split(','):
+            scanner = SCANNER_TYPES[name]()
+            if not scanner.available():
+                print(f'{name:8s} 不可用, 跳过')
+                continue
+            result = time_scanner(scanner, args.repeat)
+            results.append(result)
+            print(f"{name:8s} median {result['median_ms']:10.3f} ms  "
+                  f"min {result['min_ms']:10.3f} ms  matched {result['matched']}")
+    finally:
+        stop.set()
+        for sock in held:
+            sock.close()
+        for proc, _ in workers:
+            proc.join()
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump({'sockets': args.sockets, 'matches': args.matches, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
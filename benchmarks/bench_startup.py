@@ -0,0 +1,63 @@
+"""启动开销基准测试
+
+在独立子进程中分别测量:
+- headless: 只导入 main (检测器 + Web 接口)
+- tray: 导入 main 后再加载托盘所需的 PIL 和 pystray
+
+输出导入耗时和进程常驻内存 (用 psutil 读取, Windows 上为峰值工作集, 其他系统为当前 RSS)。
+    python benchmarks/bench_startup.py --repeat 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r'''
+import json, sys, time
+start = time.perf_counter()
+import main
+error = None
+if {tray!r}:
+    try:
+        from PIL import Image, ImageDraw
+        import pystray
+    except Exception as e:
+        error = str(e) or e.__class__.__name__
+elapsed = time.perf_counter() - start
+import psutil
+memory = psutil.Process().memory_info()
+rss = getattr(memory, 'peak_wset', memory.rss) // 1024
+print(json.dumps({{'seconds': elapsed, 'rss_kb': rss, 'error': error}}))
+'''
+
+
+def measure(tray, repeat):
+    samples = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', CHILD.format(tray=tray)], cwd=ROOT,
+                                capture_output=True, text=True, check=True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    return {
+        'import_ms': round(statistics.median(s['seconds'] for s in samples) * 1000, 1),
+        'rss_kb': statistics.median(s['rss_kb'] for s in samples),
+        'error': samples[-1]['error'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    result = {
+        'headless': measure(False, args.repeat),
+        'tray': measure(True, args.repeat),
+    }
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
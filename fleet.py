@@ -0,0 +1,224 @@
+"""集群汇总模式
+
+并发轮询多台 WhoIsHere 代理的 ``/api/status`` 接口, 合并为一个集群视图。
+轮询在独立线程的 asyncio 事件循环中进行, 每个代理保持一条 HTTP/1.1 长连接,
+请求有单独的超时, 失败的代理按指数退避延后重试。
+"""
+import asyncio
+import json
+import random
+import threading
+import time
+from datetime import datetime
+
+DEFAULT_AGENT_PORT = 51472
+
+
+def load_agents(path):
+    """读取代理列表文件, 每行一个 host[:port] (IPv6 写作 [addr]:port), # 之后为注释"""
+    agents = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            if line.startswith('['):
+                host, _, port = line[1:].partition(']')
+                port = port.lstrip(':')
+            elif line.count(':') == 1:
+                host, _, port = line.partition(':')
+            else:
+                host, port = line, ''
+            agents.append((host, int(port) if port else DEFAULT_AGENT_PORT))
+    return agents
+
+
+class HttpError(Exception):
+    pass
+
+
+class KeepAliveConnection:
+    """到单个代理的 HTTP/1.1 长连接, 断开后下次请求自动重连"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self._reader = None
+        self._writer = None
+
+    async def get_json(self, path):
+        if self._writer is None or self._writer.is_closing():
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            self._writer.write(
+                f'GET {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n'
+                'Accept: application/json\r\nConnection: keep-alive\r\n\r\n'.encode('ascii')
+            )
+            status, headers, body = await self._read_response()
+        except BaseException:
+            self.close()
+            raise
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+        if status != 200:
+            raise HttpError(f'HTTP {status}')
+        return json.loads(body)
+
+    async def _read_response(self):
+        status_line = await self._reader.readline()
+        if not status_line:
+            raise ConnectionError('连接已被关闭')
+        parts = status_line.split(None, 2)
+        status = int(parts[1])
+        headers = {}
+        while True:
+            line = await self._reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if 'content-length' in headers:
+            body = await self._reader.readexactly(int(headers['content-length']))
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await self._reader.readline()).split(b';', 1)[0], 16)
+                if size == 0:
+                    await self._reader.readline()
+                    break
+                chunks.append(await self._reader.readexactly(size))
+                await self._reader.readline()
+            body = b''.join(chunks)
+        else:
+            body = await self._reader.read()
+            headers['connection'] = 'close'
+        return status, headers, body
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+
+class AgentState:
+    """单个代理的最近一次轮询结果"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.connection = KeepAliveConnection(host, port)
+        self.status = None
+        self.error = None
+        self.failures = 0
+        self.last_ok = None
+        self.latency = None
+        self.next_attempt = 0.0
+
+    @property
+    def name(self):
+        return f'{self.host}:{self.port}'
+
+    def to_dict(self):
+        status = self.status or {}
+        return {
+            'agent': self.name,
+            'online': self.error is None and self.status is not None,
+            'error': self.error,
+            'failures': self.failures,
+            'last_ok': datetime.fromtimestamp(self.last_ok).isoformat() if self.last_ok else None,
+            'latency_ms': round(self.latency * 1000, 2) if self.latency is not None else None,
+            'is_remote_session': status.get('is_remote_session', False),
+            'user_count': status.get('user_count', 0),
+            'remote_users': status.get('remote_users', []),
+            'last_check_time': status.get('last_check_time'),
+        }
+
+
+class FleetCollector:
+    """并发轮询所有代理并维护合并后的集群视图"""
+
+    def __init__(self, agents, interval=1.0, timeout=2.0, concurrency=256, max_backoff=60.0):
+        self.agents = [AgentState(host, port) for host, port in agents]
+        self.interval = interval
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.max_backoff = max_backoff
+        self.last_round = None
+        self.last_round_duration = None
+        self._thread = None
+        self._loop = None
+        self._stopping = False
+
+    async def _poll(self, agent, semaphore):
+        async with semaphore:
+            start = time.monotonic()
+            try:
+                status = await asyncio.wait_for(agent.connection.get_json('/api/status'), self.timeout)
+            except Exception as e:
+                agent.connection.close()
+                agent.failures += 1
+                agent.error = str(e) or e.__class__.__name__
+                # 指数退避并加入随机抖动, 避免同时重试 (指数有上限, 长期离线时不会溢出)
+                delay = min(self.max_backoff, self.interval * (2 ** min(agent.failures, 16)))
+                agent.next_attempt = time.monotonic() + delay * random.uniform(0.8, 1.2)
+                return
+            agent.latency = time.monotonic() - start
+            agent.status = status
+            agent.error = None
+            agent.failures = 0
+            agent.last_ok = time.time()
+            agent.next_attempt = 0.0
+
+    async def poll_once(self):
+        """轮询一轮所有到期的代理"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        start = time.monotonic()
+        due = [a for a in self.agents if a.next_attempt <= start]
+        results = await asyncio.gather(*(self._poll(a, semaphore) for a in due), return_exceptions=True)
+        for agent, result in zip(due, results):
+            if isinstance(result, Exception):
+                print(f"轮询代理 {agent.name} 出错: {result}")
+        self.last_round = time.time()
+        self.last_round_duration = time.monotonic() - start
+
+    async def run(self):
+        while not self._stopping:
+            start = time.monotonic()
+            try:
+                await self.poll_once()
+            except Exception as e:
+                # 单轮出错不能让轮询线程退出, 否则集群视图会一直停留在旧数据
+                print(f"集群轮询出错: {e}")
+            await asyncio.sleep(max(0.0, self.interval - (time.monotonic() - start)))
+        for agent in self.agents:
+            agent.connection.close()
+
+    def start(self):
+        """在后台线程中启动轮询"""
+        def target():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.run())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=target, name='fleet-collector', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping = True
+        if self._thread is not None:
+            self._thread.join()
+
+    def view(self):
+        """合并后的集群视图"""
+        agents = [a.to_dict() for a in self.agents]
+        online = [a for a in agents if a['online']]
+        return {
+            'agents': agents,
+            'agent_count': len(agents),
+            'online_count': len(online),
+            'active_count': sum(1 for a in online if a['is_remote_session']),
+            'user_count': sum(a['user_count'] for a in online),
+            'last_round': datetime.fromtimestamp(self.last_round).isoformat() if self.last_round else None,
+            'last_round_ms': round(self.last_round_duration * 1000, 2) if self.last_round_duration is not None else None,
+        }
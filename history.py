@@ -0,0 +1,266 @@
+"""连接生命周期跟踪与历史存储
+
+对比相邻两次扫描的连接集合, 生成连接建立/断开事件 (含开始时间、结束时间和持续时长),
+并保存在固定容量的内存环形缓冲区中; ``HistoryStore`` 把事件批量写入 SQLite,
+用于跨重启的长期查询。
+"""
+import queue
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+
+def _isoformat(timestamp):
+    return datetime.fromtimestamp(timestamp).isoformat() if timestamp is not None else None
+
+
+class ConnectionTracker:
+    """增量连接跟踪器
+
+    调用方 (快照对比) 已经算出新增和消失的连接, 跟踪器只处理这些连接,
+    不再对全部连接做差分, 因此每次更新的开销与变化的连接数成正比。
+    """
+
+    def __init__(self, capacity=1000):
+        self._active = {}
+        self._events = deque(maxlen=capacity)
+        self._next_id = 1
+        self._lock = threading.Lock()
+        # 新事件的订阅者, 以事件字典为参数调用
+        self.listeners = []
+
+    def update(self, added, removed, now):
+        """输入本次扫描相对上一次新增和消失的连接标识 (远程IP, 远程端口, 本地端口)
+        以及扫描时间(epoch秒), 返回本次产生的事件"""
+        active = self._active
+        events = []
+        with self._lock:
+            for key in removed:
+                start = active.pop(key, None)
+                if start is not None:
+                    events.append(self._append('disconnect', key, start, now))
+            for key in added:
+                if key not in active:
+                    active[key] = now
+                    events.append(self._append('connect', key, now, None))
+        for event in events:
+            for listener in self.listeners:
+                try:
+                    listener(event)
+                except Exception as e:
+                    print(f"处理连接事件时出错: {e}")
+        return events
+
+    def close_all(self, now):
+        """结束所有仍在连接中的会话 (服务退出时调用), 返回断开事件; 不通知订阅者"""
+        with self._lock:
+            events = [self._append('disconnect', key, start, now) for key, start in self._active.items()]
+            self._active.clear()
+        return events
+
+    def _append(self, event_type, key, start, end):
+        remote_ip, remote_port, local_port = key
+        event = {
+            'id': self._next_id,
+            'type': event_type,
+            'remote_ip': remote_ip,
+            'remote_port': remote_port,
+            'local_port': local_port,
+            'start_ts': start,
+            'end_ts': end,
+            'start_time': _isoformat(start),
+            'end_time': _isoformat(end),
+            'duration': round(end - start, 3) if end is not None else None,
+        }
+        self._next_id += 1
+        self._events.append(event)
+        return event
+
+    def page(self, cursor=None, limit=50):
+        """按时间倒序分页读取事件, cursor 为上一页返回的 next_cursor"""
+        with self._lock:
+            if not self._events:
+                return [], None
+            first_id = self._events[0]['id']
+            end = len(self._events) if cursor is None else max(0, min(cursor - first_id, len(self._events)))
+            start = max(0, end - limit)
+            events = [self._events[i] for i in range(end - 1, start - 1, -1)]
+        next_cursor = events[-1]['id'] if events and start > 0 else None
+        return events, next_cursor
+
+    def active_sessions(self, now):
+        """当前仍在连接中的会话及其已持续时长"""
+        with self._lock:
+            items = list(self._active.items())
+        return [{
+            'remote_ip': key[0],
+            'remote_port': key[1],
+            'local_port': key[2],
+            'start_time': _isoformat(start),
+            'duration': round(now - start, 3),
+        } for key, start in items]
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    type TEXT NOT NULL,
+    remote_ip TEXT NOT NULL,
+    remote_port INTEGER,
+    local_port INTEGER,
+    start_ts REAL NOT NULL,
+    end_ts REAL,
+    duration REAL
+);
+CREATE INDEX IF NOT EXISTS idx_events_time ON events(start_ts);
+CREATE INDEX IF NOT EXISTS idx_events_ip ON events(remote_ip, type, start_ts);
+DROP INDEX IF EXISTS idx_events_daily;
+CREATE INDEX IF NOT EXISTS idx_events_end ON events(type, end_ts);
+"""
+
+# 会话 [start_ts, end_ts] 在本地零点处拆分成若干段, 再按段所在的本地日期汇总
+_NEXT_MIDNIGHT = "CAST(strftime('%s', {0}, 'unixepoch', 'localtime', 'start of day', '+1 day', 'utc') AS REAL)"
+_DAILY_TOTALS = f"""
+WITH RECURSIVE segments(seg_start, seg_end, end_ts) AS (
+    SELECT start_ts, MIN(end_ts, {_NEXT_MIDNIGHT.format('start_ts')}), end_ts FROM events
+    WHERE type = 'disconnect' AND end_ts >= ?
+    UNION ALL
+    SELECT seg_end, MIN(end_ts, {_NEXT_MIDNIGHT.format('seg_end')}), end_ts FROM segments
+    WHERE seg_end < end_ts
+)
+SELECT date(seg_start, 'unixepoch', 'localtime') AS day,
+       ROUND(SUM(seg_end - seg_start), 3) AS total_seconds, COUNT(*) AS sessions
+FROM segments
+WHERE day >= date(?, 'unixepoch', 'localtime')
+GROUP BY day ORDER BY day
+"""
+
+_INSERT = (
+    'INSERT INTO events (type, remote_ip, remote_port, local_port, start_ts, end_ts, duration) '
+    'VALUES (?, ?, ?, ?, ?, ?, ?)'
+)
+
+
+class HistoryStore:
+    """基于 SQLite (WAL 模式) 的连接事件存储
+
+    事件先进入有界队列, 由独立的写线程按批提交, 扫描线程从不等待磁盘同步;
+    队列满时丢弃新事件并计数。写线程每隔 maintenance_interval 秒清理超过
+    retention_days 天的数据并回收空闲页。
+    """
+
+    def __init__(self, path, retention_days=180, batch_size=500, flush_interval=1.0,
+                 maintenance_interval=3600, queue_size=10000):
+        self.path = path
+        self.retention_days = retention_days
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.maintenance_interval = maintenance_interval
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._local = threading.local()
+
+        conn = sqlite3.connect(path)
+        # auto_vacuum 只能在建表前设置, 对已有数据库不生效
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(_SCHEMA)
+        conn.close()
+
+        self._writer = threading.Thread(target=self._write_loop, name='history-writer', daemon=True)
+        self._writer.start()
+
+    def add(self, event):
+        """提交一个事件, 不阻塞调用方"""
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        """写入剩余事件并停止写线程"""
+        self._queue.put(None)
+        self._writer.join()
+
+    def _next_batch(self):
+        """阻塞等待第一个事件, 再在 flush_interval 内尽量凑满一批; 返回 (批次, 是否继续)"""
+        batch = []
+        try:
+            item = self._queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return batch, True
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            if item is None:
+                return batch, False
+            batch.append((
+                item['type'], item['remote_ip'], item['remote_port'], item['local_port'],
+                item['start_ts'], item['end_ts'], item['duration']
+            ))
+            if len(batch) >= self.batch_size:
+                return batch, True
+            try:
+                item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                return batch, True
+
+    def _write_loop(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        next_maintenance = time.monotonic()
+        running = True
+        while running:
+            batch, running = self._next_batch()
+            try:
+                if batch:
+                    with conn:
+                        conn.executemany(_INSERT, batch)
+                if time.monotonic() >= next_maintenance:
+                    self._maintain(conn)
+                    next_maintenance = time.monotonic() + self.maintenance_interval
+            except sqlite3.Error as e:
+                print(f"写入连接历史时出错: {e}")
+        conn.close()
+
+    def _maintain(self, conn):
+        """删除过期数据并回收空间"""
+        cutoff = time.time() - self.retention_days * 86400
+        with conn:
+            deleted = conn.execute('DELETE FROM events WHERE start_ts < ?', (cutoff,)).rowcount
+        if deleted:
+            conn.execute('PRAGMA incremental_vacuum')
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def _reader(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path)
+            conn.row_factory = sqlite3.Row
+        return conn
+
+    def sessions(self, remote_ip=None, days=30, limit=500):
+        """查询最近若干天内已结束的会话, 可按远程IP过滤"""
+        since = time.time() - days * 86400
+        if remote_ip:
+            rows = self._reader().execute(
+                'SELECT remote_ip, remote_port, local_port, start_ts, end_ts, duration FROM events '
+                "WHERE remote_ip = ? AND type = 'disconnect' AND start_ts >= ? "
+                'ORDER BY start_ts DESC LIMIT ?', (remote_ip, since, limit))
+        else:
+            rows = self._reader().execute(
+                'SELECT remote_ip, remote_port, local_port, start_ts, end_ts, duration FROM events '
+                "WHERE type = 'disconnect' AND start_ts >= ? "
+                'ORDER BY start_ts DESC LIMIT ?', (since, limit))
+        return [dict(row, start_time=_isoformat(row['start_ts']), end_time=_isoformat(row['end_ts']))
+                for row in rows]
+
+    def daily_totals(self, days=30):
+        """按天汇总已结束会话的连接时长(秒)和会话数
+
+        跨越本地零点的会话按零点拆分, 每一段计入所在的那一天 (会话在它涉及的每一天都计一次)。
+        """
+        since = time.time() - days * 86400
+        rows = self._reader().execute(_DAILY_TOTALS, (since, since))
+        return [dict(row) for row in rows]
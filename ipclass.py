@@ -0,0 +1,151 @@
+"""远程IP分类
+
+从标签目录读取 CIDR 列表: 每个 ``<标签>.txt`` 文件每行一个网段 (IPv4 或 IPv6, # 之后为注释),
+例如 ``vpn.txt``、``office.txt``、``vendor.txt``。所有网段在加载时合并成按起始地址排序、
+互不重叠的区间表 (嵌套网段以更长的前缀为准), 每次查询用二分查找, 复杂度 O(log n)。
+不在任何网段中的地址标记为 ``unknown``。
+
+文件的修改时间变化 (或增删文件) 后, 下一次 ``refresh()`` 会重建区间表并整体替换;
+新文件有错误时保留旧表继续使用。
+"""
+import ipaddress
+import os
+import time
+from bisect import bisect_right
+
+UNKNOWN = 'unknown'
+LABEL_SUFFIX = '.txt'
+
+
+def read_prefixes(path):
+    """读取一个 CIDR 列表文件, 返回 ip_network 列表"""
+    networks = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            try:
+                networks.append(ipaddress.ip_network(line, strict=False))
+            except ValueError as e:
+                raise ValueError(f'{path}:{lineno}: {e}') from None
+    return networks
+
+
+def build_intervals(prefixes):
+    """把 (起始, 结束, 标签) 网段合并为互不重叠的 (起始列表, 结束列表, 标签列表)
+
+    CIDR 网段之间只有包含或不相交两种关系, 按 (起始升序, 结束降序) 排序后用栈扫描一遍:
+    栈顶是当前最内层的网段, 它覆盖的部分用它的标签, 其余部分归还给外层网段。
+    完全相同的网段以第一次出现的为准。
+    """
+    unique = {}
+    for start, end, label in prefixes:
+        unique.setdefault((start, end), label)
+
+    starts, ends, labels = [], [], []
+
+    def emit(start, end, label):
+        if start > end:
+            return
+        if starts and labels[-1] == label and ends[-1] + 1 == start:
+            ends[-1] = end
+        else:
+            starts.append(start)
+            ends.append(end)
+            labels.append(label)
+
+    stack = []
+    cursor = 0
+    for (start, end), label in sorted(unique.items(), key=lambda item: (item[0][0], -item[0][1])):
+        while stack and stack[-1][0] < start:
+            top_end, top_label = stack.pop()
+            emit(cursor, top_end, top_label)
+            cursor = max(cursor, top_end + 1)
+        if stack:
+            emit(cursor, start - 1, stack[-1][1])
+        cursor = start
+        stack.append((end, label))
+    while stack:
+        top_end, top_label = stack.pop()
+        emit(cursor, top_end, top_label)
+        cursor = max(cursor, top_end + 1)
+    return starts, ends, labels
+
+
+class IntervalIndex:
+    """IPv4 和 IPv6 各一张有序区间表"""
+
+    def __init__(self, labeled_networks=()):
+        by_version = {4: [], 6: []}
+        for network, label in labeled_networks:
+            by_version[network.version].append(
+                (int(network.network_address), int(network.broadcast_address), label))
+        self._tables = {version: build_intervals(prefixes) for version, prefixes in by_version.items()}
+        self.size = sum(len(table[0]) for table in self._tables.values())
+
+    def lookup(self, address):
+        """返回地址所属的标签, 不在任何网段中时返回 None"""
+        starts, ends, labels = self._tables[address.version]
+        value = int(address)
+        i = bisect_right(starts, value) - 1
+        if i >= 0 and value <= ends[i]:
+            return labels[i]
+        return None
+
+
+class IpClassifier:
+    """按标签目录中的 CIDR 列表给远程IP分类, 文件变化时自动重新加载"""
+
+    def __init__(self, directory, check_interval=5.0):
+        self.directory = directory
+        self.check_interval = check_interval
+        self.index = IntervalIndex()
+        self.labels = ()
+        self.loaded_at = None
+        self._signature = None
+        self._failed_signature = None
+        self._checked_at = 0.0
+        self.refresh(force=True)
+
+    def _scan_files(self):
+        """标签目录中的 (文件名, 修改时间, 大小) 列表, 用于判断是否需要重新加载"""
+        entries = []
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith(LABEL_SUFFIX):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((name, stat.st_mtime_ns, stat.st_size))
+        return tuple(entries)
+
+    def refresh(self, force=False):
+        """距上次检查超过 check_interval 秒时检查文件, 有变化则重建索引; 返回是否重新加载"""
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.check_interval:
+            return False
+        self._checked_at = now
+        signature = None
+        try:
+            signature = self._scan_files()
+            if signature in (self._signature, self._failed_signature):
+                return False
+            labeled = []
+            for name, _, _ in signature:
+                label = name[:-len(LABEL_SUFFIX)]
+                labeled.extend((network, label) for network in read_prefixes(os.path.join(self.directory, name)))
+            index = IntervalIndex(labeled)
+        except (OSError, ValueError) as e:
+            # 同一份有错误的文件只报告一次, 修改后再重试
+            self._failed_signature = signature
+            print(f"加载IP分类列表出错, 继续使用旧的列表: {e}")
+            return False
+        self.index = index
+        self.labels = tuple(name[:-len(LABEL_SUFFIX)] for name, _, _ in signature)
+        self._signature = signature
+        self.loaded_at = time.time()
+        return True
+
+    def classify(self, address):
+        """返回 ipaddress 地址对象的标签; 无法解析的地址或不在任何网段中时为 unknown"""
+        if not isinstance(address, (ipaddress.IPv4Address, ipaddress.IPv6Address)):
+            return UNKNOWN
+        return self.index.lookup(address) or UNKNOWN
@@ -1,174 +1,628 @@
 import os
+import sys
+import json
+import argparse
+import multiprocessing
 import time
-import subprocess
+import random
+import signal
+import sqlite3
+import gzip
+import hashlib
 import threading
+from collections import deque, namedtuple
 from datetime import datetime
-from flask import Flask, render_template, jsonify
-import psutil
-import pystray
-from PIL import Image, ImageDraw
+from flask import Flask, Response, g, jsonify, request
+from netscan import build_scanner_chain
+from history import ConnectionTracker, HistoryStore
+from records import ConnectionRecord, ConnectionTable
+from ipclass import IpClassifier
+from rules import RuleMatcher, WatchRule, load_rules
+from fleet import FleetCollector, load_agents
+from alerts import load_alerts
+from metrics import Counter, Gauge, Histogram, Registry
+from procinfo import ProcessInfoCache
+from scanworker import WorkerScanner
+from tcpquality import TcpQualityTracker
 
 app = Flask(__name__)
 
+# 远程桌面端口
+RDP_PORT = 43389
+
+# 监控规则文件 (JSON), 未配置时只监控远程桌面端口, 格式见 rules.example.json
+RULES_FILE = os.environ.get('WHOISHERE_RULES')
+
+# 告警配置文件 (JSON), 配置 webhook / syslog / 脚本通知, 格式见 alerts.example.json
+ALERTS_FILE = os.environ.get('WHOISHERE_ALERTS')
+
+# 扫描后端: auto / netlink / proc / psutil / netstat
+SCANNER_BACKEND = os.environ.get('WHOISHERE_SCANNER', 'auto')
+
+# 设为1时扫描器链运行在独立的子进程中; 单次扫描超过 SCAN_WORKER_TIMEOUT 秒无响应时重启子进程
+SCAN_WORKER = os.environ.get('WHOISHERE_SCAN_WORKER', '0') == '1'
+SCAN_WORKER_TIMEOUT = float(os.environ.get('WHOISHERE_SCAN_WORKER_TIMEOUT', '30'))
+
+# 连接质量采集: 设为1时通过 netlink 读取每个会话的 tcp_info (RTT、速率、重传, 仅 Linux),
+# 每个会话保留最近 TCP_SERIES_SIZE 次扫描的时间序列
+TCP_INFO = os.environ.get('WHOISHERE_TCP_INFO', '0') == '1'
+TCP_SERIES_SIZE = int(os.environ.get('WHOISHERE_TCP_SERIES_SIZE', '60'))
+
+# 远程IP分类: 标签目录中每个 <标签>.txt 是一个 CIDR 列表 (格式见 iplabels.example/),
+# 文件变化后自动重新加载; IGNORED_IP_LABELS 中的标签 (逗号分隔) 不计入远程会话状态
+IP_LABELS_DIR = os.environ.get('WHOISHERE_IP_LABELS')
+IGNORED_IP_LABELS = frozenset(l.strip() for l in os.environ.get('WHOISHERE_IGNORE_LABELS', '').split(',') if l.strip())
+
+# 连接快照有效期(秒)。快照通常由后台监控刷新, 超过有效期时接口才会自行扫描
+SNAPSHOT_TTL = float(os.environ.get('WHOISHERE_SNAPSHOT_TTL', '60'))
+
+# 状态确认: 连续 CONFIRM_COUNT 次扫描结果一致且都落在 CONFIRM_WINDOW 秒内才切换状态
+CONFIRM_COUNT = int(os.environ.get('WHOISHERE_CONFIRM_COUNT', '2'))
+CONFIRM_WINDOW = float(os.environ.get('WHOISHERE_CONFIRM_WINDOW', '10'))
+# 状态待确认时后台监控的复查间隔(秒)
+CONFIRM_RECHECK_INTERVAL = 1
+
+# 自适应轮询(秒): 连接刚变化后按最短间隔复查, 有连接时按活跃间隔轮询,
+# 空闲或出错时每次乘以退避倍数, 直到上限; 每次间隔再加上 ±POLL_JITTER 比例的随机抖动
+POLL_MIN_INTERVAL = float(os.environ.get('WHOISHERE_POLL_MIN', '2'))
+POLL_ACTIVE_INTERVAL = float(os.environ.get('WHOISHERE_POLL_ACTIVE', '5'))
+POLL_MAX_INTERVAL = float(os.environ.get('WHOISHERE_POLL_MAX', '30'))
+POLL_BACKOFF = 2
+POLL_JITTER = 0.1
+
+# 内存中保留的连接历史事件条数
+HISTORY_SIZE = int(os.environ.get('WHOISHERE_HISTORY_SIZE', '1000'))
+
+# 增量接口保留的变更记录条数 (只记录有变化的版本)
+CHANGELOG_SIZE = int(os.environ.get('WHOISHERE_CHANGELOG_SIZE', '256'))
+
+def user_data_dir():
+    """当前用户的数据目录: Windows 为 %LOCALAPPDATA%\\WhoIsHere, 其他系统为 $XDG_DATA_HOME/whoishere"""
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser(r'~\AppData\Local')
+        return os.path.join(base, 'WhoIsHere')
+    base = os.environ.get('XDG_DATA_HOME') or os.path.expanduser('~/.local/share')
+    return os.path.join(base, 'whoishere')
+
+# 连接历史数据库路径 (默认在当前用户的数据目录中, 程序目录可以是只读的; 设为空字符串则不持久化) 和保留天数
+HISTORY_DB = os.environ.get('WHOISHERE_DB', os.path.join(user_data_dir(), 'whoishere.db'))
+HISTORY_RETENTION_DAYS = int(os.environ.get('WHOISHERE_RETENTION_DAYS', '180'))
+
+# SSE 推送的心跳间隔(秒)和用于断线续传的事件缓存条数
+STREAM_HEARTBEAT = 15
+STREAM_BACKLOG = 100
+
+# Web 服务: 监听地址、端口、生产模式线程数, 以及启用 gzip 压缩的最小响应大小(字节)
+HTTP_HOST = os.environ.get('WHOISHERE_HOST', '0.0.0.0')
+HTTP_PORT = int(os.environ.get('WHOISHERE_PORT', '51472'))
+HTTP_THREADS = int(os.environ.get('WHOISHERE_HTTP_THREADS', '16'))
+GZIP_MIN_SIZE = 1024
+
+# 每个 SSE 连接在推送期间占用一个 Web 线程: 同时推送的连接数上限 (默认线程数的1/4,
+# 超出时返回 503, 网页回退为轮询) 和单个连接的最长持续时间(秒, 到期后浏览器自动重连)
+STREAM_MAX_CLIENTS = int(os.environ.get('WHOISHERE_STREAM_MAX_CLIENTS', str(max(1, HTTP_THREADS // 4))))
+STREAM_MAX_AGE = float(os.environ.get('WHOISHERE_STREAM_MAX_AGE', '300'))
+
+# 网页资源目录 (打包后的程序从解压目录 sys._MEIPASS 读取) 和浏览器缓存时间(秒)
+ASSETS_DIR = os.path.join(getattr(sys, '_MEIPASS', os.path.dirname(os.path.abspath(__file__))), 'assets')
+ASSET_MAX_AGE = int(os.environ.get('WHOISHERE_ASSET_MAX_AGE', '86400'))
+
+# 运行指标, 通过 /metrics 输出
+metrics_registry = Registry()
+SCAN_DURATION = Histogram('whoishere_scan_duration_seconds', '单次扫描耗时', ['backend'], metrics_registry)
+SCAN_PARSED = Counter('whoishere_scan_parsed_total', '扫描解析的行数或套接字数', ['backend'], metrics_registry)
+SCAN_ERRORS = Counter('whoishere_scan_errors_total', '扫描出错次数', ['backend'], metrics_registry)
+MATCHED_CONNECTIONS = Gauge('whoishere_matched_connections', '最近一次扫描命中规则的连接数', ['rule'], metrics_registry)
+POLL_INTERVAL = Gauge('whoishere_poll_interval_seconds', '后台监控当前的轮询间隔', (), metrics_registry)
+DEBOUNCE_FLIPS = Counter('whoishere_debounce_flips_total', '确认状态切换次数', (), metrics_registry)
+HTTP_DURATION = Histogram('whoishere_http_request_duration_seconds', 'HTTP 请求处理耗时',
+                          ['route', 'method', 'status'], metrics_registry)
+
+# 一次扫描得到的连接快照, 发布后不再修改; users 是按连接标识索引的 ConnectionTable。
+# version 是连接数据的版本, 只在连接变化时递增, changed_at 为该版本产生的时间
+ConnectionSnapshot = namedtuple('ConnectionSnapshot', ['version', 'taken_at', 'monotonic', 'users', 'changed_at'])
+
+class StatusDebouncer:
+    """带时间窗口的状态确认状态机 - 只记录时间戳, 从不等待
+
+    扫描结果与已确认状态不同时进入待确认; 在 confirm_window 秒内累计
+    confirm_count 次相同结果才切换, 超出窗口则重新计数。
+    """
+
+    def __init__(self, confirm_count=CONFIRM_COUNT, confirm_window=CONFIRM_WINDOW, initial=False):
+        self.confirm_count = max(1, confirm_count)
+        self.confirm_window = confirm_window
+        self.confirmed = initial
+        self.pending_since = None
+        self.pending_count = 0
+        self.flips = 0
+
+    @property
+    def pending(self):
+        return self.pending_since is not None
+
+    def observe(self, raw, now=None):
+        """输入一次扫描结果, 返回已确认状态是否发生了切换"""
+        now = time.monotonic() if now is None else now
+        if raw == self.confirmed:
+            self.pending_since = None
+            self.pending_count = 0
+            return False
+
+        if self.pending_since is None or now - self.pending_since > self.confirm_window:
+            self.pending_since = now
+            self.pending_count = 0
+        self.pending_count += 1
+
+        if self.pending_count >= self.confirm_count:
+            return self.force(raw)
+        return False
+
+    def force(self, raw):
+        """跳过确认直接设置状态, 返回状态是否发生了切换"""
+        changed = raw != self.confirmed
+        self.confirmed = raw
+        self.pending_since = None
+        self.pending_count = 0
+        if changed:
+            self.flips += 1
+        return changed
+
+class PollScheduler:
+    """后台监控的自适应轮询间隔
+
+    连接变化或状态待确认时立即回到最短间隔; 有连接时不超过活跃间隔;
+    空闲或扫描出错时按倍数退避到上限。等待使用 Event, 可被提前唤醒。
+    """
+
+    def __init__(self, min_interval=POLL_MIN_INTERVAL, active_interval=POLL_ACTIVE_INTERVAL,
+                 max_interval=POLL_MAX_INTERVAL, backoff=POLL_BACKOFF, jitter=POLL_JITTER):
+        self.min_interval = min_interval
+        self.active_interval = max(min_interval, active_interval)
+        self.max_interval = max(min_interval, max_interval)
+        self.backoff = backoff
+        self.jitter = jitter
+        self.interval = min_interval
+        self.delay = min_interval
+        self.reason = 'startup'
+        self.next_run = None
+        self.generation = 0
+        self._wakeup = threading.Event()
+
+    def schedule(self, active=False, changed=False, pending=False, error=False):
+        """根据本次扫描结果计算下次扫描前的等待时间(秒)"""
+        if pending:
+            self.interval, self.reason = min(CONFIRM_RECHECK_INTERVAL, self.min_interval), 'pending'
+        elif changed:
+            self.interval, self.reason = self.min_interval, 'changed'
+        else:
+            grown = min(self.max_interval, max(self.interval, self.min_interval) * self.backoff)
+            if error:
+                self.interval, self.reason = grown, 'error'
+            elif active:
+                self.interval, self.reason = min(grown, self.active_interval), 'active'
+            else:
+                self.interval, self.reason = grown, 'idle'
+        self.delay = self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+        self.next_run = datetime.fromtimestamp(time.time() + self.delay)
+        self.generation += 1
+        POLL_INTERVAL.set(round(self.delay, 3))
+        return self.delay
+
+    def wait(self):
+        """等待到下次扫描, 被 wake() 唤醒时提前返回"""
+        self._wakeup.wait(self.delay)
+        self._wakeup.clear()
+
+    def wake(self):
+        """立即开始下一次扫描, 之后按最短间隔轮询"""
+        self.interval = self.min_interval
+        self._wakeup.set()
+
+    def to_dict(self):
+        return {
+            'interval_seconds': round(self.delay, 3),
+            'reason': self.reason,
+            'next_check_time': self.next_run.isoformat() if self.next_run else None,
+        }
+
+class EventBroadcaster:
+    """状态变化事件广播 - 每个事件只序列化一次, 保留最近的事件用于 Last-Event-ID 续传"""
+
+    def __init__(self, backlog=STREAM_BACKLOG):
+        self._cond = threading.Condition()
+        self._events = deque(maxlen=backlog)
+        self.last_id = 0
+
+    def publish(self, event, payload):
+        """发布事件并唤醒所有等待中的订阅者"""
+        data = json.dumps(payload, ensure_ascii=False)
+        with self._cond:
+            self.last_id += 1
+            self._events.append((self.last_id, event, data))
+            self._cond.notify_all()
+        return self.last_id
+
+    def events_after(self, last_id):
+        """返回 last_id 之后的事件; 续传点已被淘汰, 或大于当前编号 (服务重启前的编号) 时返回 None"""
+        with self._cond:
+            if last_id > self.last_id:
+                return None
+            if last_id == self.last_id:
+                return []
+            if not self._events or self._events[0][0] > last_id + 1:
+                return None
+            return [e for e in self._events if e[0] > last_id]
+
+    def wait(self, last_id, timeout):
+        """等待 last_id 之后的新事件, 超时返回空列表"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.last_id > last_id, timeout)
+        return self.events_after(last_id)
+
+class ScanFailed(RuntimeError):
+    """一次扫描失败 (所有扫描后端都出错): 不发布快照, 状态保持不变"""
+
+def default_rules():
+    """读取监控规则, 未配置规则文件时只监控远程桌面端口"""
+    if RULES_FILE:
+        return load_rules(RULES_FILE)
+    return [WatchRule('RDP', [RDP_PORT])]
+
 class RemoteDesktopDetector:
-    def __init__(self):
+    def __init__(self, scanners=None, rules=None):
         self.is_remote_session = False
         self.last_check_time = None
-        
-    def get_remote_desktop_users(self):
-        """获取远程桌面连接用户信息 - 基于端口43389连接检测"""
-        try:
-            users = []
-            
-            # 方法1: 检查端口43389的ESTABLISHED连接
-            try:
-                result = subprocess.run(
-                    ['netstat', '-an'],
-                    capture_output=True, text=True, timeout=5
-                )
-                if result.returncode == 0:
-                    lines = result.stdout.strip().split('\n')
-                    for line in lines:
-                        if '43389' in line and 'ESTABLISHED' in line:
-                            # 解析连接信息
-                            parts = line.split()
-                            if len(parts) >= 4:
-                                local_address = parts[1]
-                                remote_address = parts[2]
-                                state = parts[3]
-                                
-                                # 提取远程IP地址
-                                if ':' in remote_address:
-                                    remote_ip = remote_address.split(':')[0]
-                                else:
-                                    remote_ip = remote_address
-                                
-                                users.append({
-                                    'username': f'Remote Connection from {remote_ip}',
-                                    'session_name': 'RDP Connection',
-                                    'session_id': 'Network',
-                                    'state': 'Active',
-                                    'connection_type': 'RDP',
-                                    'remote_ip': remote_ip,
-                                    'local_address': local_address,
-                                    'remote_address': remote_address
-                                })
-            except Exception as e:
-                print(f"检查网络连接时出错: {e}")
-            
-            # 方法2: 使用netstat -ano获取更详细的连接信息
+        self.debouncer = StatusDebouncer()
+        # 监控规则在首次使用时才读取, 导入模块时不读取规则文件
+        self._rules = rules
+        self._matcher = None
+        self.process_cache = ProcessInfoCache()
+        self.tcp_quality = TcpQualityTracker(TCP_SERIES_SIZE) if TCP_INFO else None
+        # IP 分类列表在首次扫描时才读取和建立索引, 导入模块时不读取文件
+        self.classifier = None
+        # 扫描器链在首次扫描时才构建, 导入模块时不做任何探测
+        self.scanners = scanners
+        self.scanner_name = None
+        self.snapshot = None
+        self.tracker = ConnectionTracker(HISTORY_SIZE)
+        # 确认状态切换的订阅者, 以 {'type': 'status', ...} 事件字典为参数调用
+        self.status_listeners = []
+        # 版本号从进程启动时的 epoch 开始计数, 重启后旧版本号自动失效
+        self.epoch = int(time.time())
+        self._version = 0
+        self._changelog = deque()
+        self._changelog_floor = 0
+        self.last_change_version = 0
+        # 确认状态或待确认标记最近一次变化的时间, 用作 /api/status 的 Last-Modified
+        self.status_changed_at = None
+        self._refresh_cond = threading.Condition()
+        self._refreshing = False
+        self._refresh_error = None
+        self._attempted_at = 0.0
+        # 最近一次扫描失败的原因和时间, 以及连续失败的次数 (用于 /api/health)
+        self.last_scan_error = None
+        self.last_scan_error_time = None
+        self.scan_failures = 0
+
+    @property
+    def matcher(self):
+        if self._matcher is None:
+            self._matcher = RuleMatcher(self._rules if self._rules is not None else default_rules())
+        return self._matcher
+
+    def scan_connections(self, ports, states):
+        """依次尝试扫描器链, 返回第一个成功后端的连接列表"""
+        if self.scanners is None:
+            if SCAN_WORKER:
+                self.scanners = [WorkerScanner(SCANNER_BACKEND, SCAN_WORKER_TIMEOUT, tcp_info=self.tcp_quality is not None)]
+            else:
+                self.scanners = build_scanner_chain(SCANNER_BACKEND, tcp_info=self.tcp_quality is not None)
+        errors = []
+        for scanner in self.scanners:
+            start = time.perf_counter()
             try:
-                result = subprocess.run(
-                    ['netstat', '-ano'],
-                    capture_output=True, text=True, timeout=5
-                )
-                if result.returncode == 0:
-                    lines = result.stdout.strip().split('\n')
-                    for line in lines:
-                        if '43389' in line and 'ESTABLISHED' in line:
-                            parts = line.split()
-                            if len(parts) >= 5:
-                                local_address = parts[1]
-                                remote_address = parts[2]
-                                state = parts[3]
-                                pid = parts[4]
-                                
-                                # 尝试获取进程信息
-                                try:
-                                    process = psutil.Process(int(pid))
-                                    process_name = process.name()
-                                except:
-                                    process_name = 'Unknown'
-                                
-                                # 提取远程IP地址
-                                if ':' in remote_address:
-                                    remote_ip = remote_address.split(':')[0]
-                                else:
-                                    remote_ip = remote_address
-                                
-                                # 检查是否已存在该连接
-                                existing_user = next((u for u in users if u.get('remote_ip') == remote_ip), None)
-                                if not existing_user:
-                                    users.append({
-                                        'username': f'Remote Connection from {remote_ip}',
-                                        'session_name': 'RDP Connection',
-                                        'session_id': pid,
-                                        'state': 'Active',
-                                        'connection_type': 'RDP',
-                                        'remote_ip': remote_ip,
-                                        'local_address': local_address,
-                                        'remote_address': remote_address,
-                                        'process_name': process_name
-                                    })
+                connections = scanner.scan(ports, states)
             except Exception as e:
-                print(f"检查详细网络连接时出错: {e}")
-            
+                SCAN_ERRORS.labels(scanner.name).inc()
+                print(f"扫描后端 {scanner.name} 出错: {e}")
+                errors.append(f'{scanner.name}: {e or e.__class__.__name__}')
+                continue
+            SCAN_DURATION.labels(scanner.name).observe(time.perf_counter() - start)
+            SCAN_PARSED.labels(scanner.name).inc(scanner.last_parsed)
+            self.scanner_name = scanner.name
+            return connections
+        raise ScanFailed('所有扫描后端均不可用 (' + '; '.join(errors) + ')')
+
+    def get_remote_desktop_users(self):
+        """获取远程连接用户信息 - 一次扫描按所有监控规则归类; 扫描失败时抛出 ScanFailed"""
+        try:
+            users = ConnectionTable()
+            now = time.time()
+            if self.classifier is None and IP_LABELS_DIR:
+                self.classifier = IpClassifier(IP_LABELS_DIR)
+            elif self.classifier is not None:
+                self.classifier.refresh()
+            for conn in self.scan_connections(self.matcher.ports, self.matcher.states):
+                rules = self.matcher.match(conn)
+                if not rules:
+                    continue
+                # 获取进程信息 (带缓存)
+                process_info = None
+                if conn.pid:
+                    connection_id = (conn.local_ip, conn.local_port, conn.remote_ip, conn.remote_port)
+                    process_info = self.process_cache.lookup(conn.pid, connection_id)
+
+                record = ConnectionRecord.from_connection(conn, rules, process_info)
+                if self.classifier is not None:
+                    record.label = self.classifier.classify(record.remote_ip)
+                if not users.add(record):
+                    continue
+                if self.tcp_quality is not None and conn.tcp_info is not None:
+                    self.tcp_quality.observe(record.key, conn.tcp_info, now)
+            self.process_cache.end_scan()
+            if self.tcp_quality is not None:
+                self.tcp_quality.end_scan()
+
             # 注意：不检测当前用户，因为当前用户一直登录着，没有意义
-            
+
             return users
-            
+
+        except ScanFailed:
+            raise
         except Exception as e:
-            print(f"获取远程桌面用户信息时出错: {e}")
-            return []
+            # 扫描失败时不能返回空列表, 否则会被当作所有连接都已断开
+            raise ScanFailed(f"获取远程桌面用户信息时出错: {e}") from e
 
-    def check_remote_desktop_status(self):
-        """检测是否有远程桌面用户连接 - 检查所有用户的RDP连接"""
+    def refresh_snapshot(self):
+        """扫描并原子发布新快照; 并发调用共享同一次扫描
+
+        扫描失败时抛出 ScanFailed, 保留上一个快照, 不记录连接变化也不更新连接跟踪。
+        """
+        with self._refresh_cond:
+            if self._refreshing:
+                # 已有扫描在进行, 等它完成后直接使用其结果
+                while self._refreshing:
+                    self._refresh_cond.wait()
+                if self._refresh_error is not None:
+                    raise ScanFailed(self._refresh_error)
+                return self.snapshot
+            self._refreshing = True
+            self._attempted_at = time.monotonic()
+
+        snapshot = None
+        error = None
         try:
-            # 获取所有远程桌面连接的用户
-            remote_users = self.get_remote_desktop_users()
-            
-            # 如果有远程桌面用户连接，返回True
-            if remote_users:
-                return True
-                
-            return False
-            
-        except Exception as e:
-            print(f"检测远程桌面状态时出错: {e}")
-            return False
+            users = self.get_remote_desktop_users()
+            taken_at = datetime.now()
+            previous = self.snapshot
+            self._record_matches(users)
+            added, removed, changed = self._record_changes(
+                previous.users if previous else ConnectionTable(), users, self._version + 1)
+            if changed:
+                self._version += 1
+                changed_at = taken_at
+            else:
+                changed_at = previous.changed_at if previous else taken_at
+            snapshot = ConnectionSnapshot(self._version, taken_at, time.monotonic(), users, changed_at)
+            # 连接跟踪直接使用这里算出的差分, 开销只与变化的连接数有关
+            self.tracker.update(added, removed, taken_at.timestamp())
+        except ScanFailed as e:
+            error = str(e)
+            raise
+        finally:
+            with self._refresh_cond:
+                if snapshot is not None:
+                    self.snapshot = snapshot
+                    self.scan_failures = 0
+                elif error is not None:
+                    self.last_scan_error = error
+                    self.last_scan_error_time = datetime.now()
+                    self.scan_failures += 1
+                self._refresh_error = error
+                self._refreshing = False
+                self._refresh_cond.notify_all()
+        return snapshot
+
+    def _record_changes(self, previous, users, version):
+        """记录相对上一版本新增、消失和内容变化的连接
+
+        返回 (新增的连接标识, 消失的连接标识, 是否有变化)
+        """
+        added_keys = users.keys() - previous.keys()
+        removed_keys = previous.keys() - users.keys()
+        modified = [users.get(k) for k in users.keys() & previous.keys() if users.get(k) != previous.get(k)]
+        if not (added_keys or removed_keys or modified):
+            return added_keys, removed_keys, False
+        if len(self._changelog) >= CHANGELOG_SIZE:
+            self._changelog_floor = self._changelog.popleft()[0]
+        self._changelog.append((version, [users.get(k) for k in added_keys],
+                                [previous.get(k) for k in removed_keys], modified))
+        self.last_change_version = version
+        return added_keys, removed_keys, True
+
+    def changes_since(self, version, current):
+        """合并 (version, current] 之间的所有变更; 变更记录已被淘汰时返回 None
+
+        current 是调用方读到的快照版本: 新版本的变更记录在快照发布之前就已写入,
+        比 current 新的记录要跳过, 否则会和之后 since=current 的请求重复返回。
+        """
+        if version < self._changelog_floor or version > current:
+            return None
+        # key -> (在 version 时是否存在, 当前的连接记录或 None)
+        merged = {}
+        for entry_version, added, removed, modified in list(self._changelog):
+            if entry_version <= version or entry_version > current:
+                continue
+            for user in added:
+                key = user.key
+                existed = merged[key][0] if key in merged else False
+                merged[key] = (existed, user)
+            for user in modified:
+                key = user.key
+                existed = merged[key][0] if key in merged else True
+                merged[key] = (existed, user)
+            for user in removed:
+                key = user.key
+                existed = merged[key][0] if key in merged else True
+                merged[key] = (existed, None)
+        changes = {'added': [], 'removed': [], 'modified': []}
+        for key, (existed, user) in merged.items():
+            if existed and user is not None:
+                changes['modified'].append(user)
+            elif existed:
+                changes['removed'].append({'remote_ip': key[0], 'remote_port': key[1], 'local_port': key[2]})
+            elif user is not None:
+                changes['added'].append(user)
+        return changes
+
+    def get_snapshot(self, max_age=None):
+        """获取当前快照, 没有快照或已过期时才刷新"""
+        max_age = SNAPSHOT_TTL if max_age is None else max_age
+        snapshot = self.snapshot
+        now = time.monotonic()
+        if snapshot is None:
+            return self.refresh_snapshot()
+        # 扫描持续失败时继续使用旧快照, 每个有效期内最多重试一次
+        if now - snapshot.monotonic > max_age and now - self._attempted_at > max_age:
+            try:
+                snapshot = self.refresh_snapshot()
+            except ScanFailed as e:
+                print(f"刷新连接快照失败, 使用旧快照: {e}")
+                snapshot = self.snapshot
+        return snapshot
+
+    def check_remote_desktop_status(self):
+        """检测是否有远程桌面用户连接 - 检查所有用户的RDP连接; 扫描失败时抛出 ScanFailed"""
+        # 重新扫描并发布快照
+        snapshot = self.refresh_snapshot()
+        
+        # 如果有远程桌面用户连接 (忽略的IP分类除外)，返回True
+        return any(self.is_counted(record) for record in snapshot.users)
     
     def update_status(self):
-        """更新连接状态 - 带确认机制"""
+        """更新连接状态 - 带确认机制, 不阻塞; 返回是否仍有待确认的状态变化
+
+        扫描失败时抛出 ScanFailed, 不计入状态确认
+        """
         current_status = self.check_remote_desktop_status()
-        current_time = datetime.now()
-        
-        # 如果状态发生变化，进行二次确认
-        if current_status != self.is_remote_session:
-            # 等待1秒后再次检查，避免误判
-            time.sleep(1)
-            confirmed_status = self.check_remote_desktop_status()
-            
-            # 只有确认状态一致才更新
-            if confirmed_status == current_status:
-                self.is_remote_session = current_status
-                # 只在前台运行时输出
-                if not (hasattr(sys, 'frozen') or sys.executable.endswith('pythonw.exe')):
-                    print(f"状态已更新: {'有外部用户远程连接' if current_status else '没有外部用户远程连接'}")
-            else:
-                if not (hasattr(sys, 'frozen') or sys.executable.endswith('pythonw.exe')):
-                    print(f"状态变化未确认，保持原状态: {'有外部用户远程连接' if self.is_remote_session else '没有外部用户远程连接'}")
-        
-        self.last_check_time = current_time
+        before = (self.debouncer.confirmed, self.debouncer.pending)
+
+        if self.debouncer.observe(current_status):
+            DEBOUNCE_FLIPS.inc()
+            self.is_remote_session = current_status
+            self._notify_status(current_status)
+            # 只在前台运行时输出
+            if not (hasattr(sys, 'frozen') or sys.executable.endswith('pythonw.exe')):
+                print(f"状态已更新: {'有外部用户远程连接' if current_status else '没有外部用户远程连接'}")
+        elif self.debouncer.pending:
+            if not (hasattr(sys, 'frozen') or sys.executable.endswith('pythonw.exe')):
+                print(f"状态变化待确认 ({self.debouncer.pending_count}/{self.debouncer.confirm_count})，保持原状态: {'有外部用户远程连接' if self.is_remote_session else '没有外部用户远程连接'}")
+
+        self.last_check_time = datetime.now()
+        if (self.debouncer.confirmed, self.debouncer.pending) != before:
+            self.status_changed_at = self.last_check_time
+        return self.debouncer.pending
+
+    def force_update(self):
+        """强制重新检测并跳过确认机制, 返回状态是否发生变化"""
+        current_status = self.check_remote_desktop_status()
+        was_pending = self.debouncer.pending
+        changed = self.debouncer.force(current_status)
+        if changed:
+            DEBOUNCE_FLIPS.inc()
+            self._notify_status(current_status)
+        self.is_remote_session = current_status
+        self.last_check_time = datetime.now()
+        if changed or was_pending:
+            self.status_changed_at = self.last_check_time
+        return changed
+
+    def _notify_status(self, status):
+        """通知状态切换的订阅者 (如告警分发器), 订阅者不得阻塞"""
+        event = {'type': 'status', 'is_remote_session': status, 'time': datetime.now().isoformat()}
+        for listener in self.status_listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                print(f"处理状态变化事件时出错: {e}")
     
+    def serialize(self, records):
+        """把连接记录转换为接口输出的字典; 开启质量采集时附加 tcp 字段 (质量数据不进入快照,
+        避免每次扫描都被视为连接变化)"""
+        if self.tcp_quality is None:
+            return [record.to_dict() for record in records]
+        return [dict(record.to_dict(), tcp=self.tcp_quality.get(record.key)) for record in records]
+
+    @staticmethod
+    def is_counted(record):
+        """连接是否计入远程会话状态 (远程IP属于忽略的分类时不计入)"""
+        return record.label not in IGNORED_IP_LABELS
+
+    def count_by_rule(self, users):
+        """按规则统计连接数, 没有连接的规则计为0"""
+        counts = {rule.name: 0 for rule in self.matcher.rules}
+        for record in users:
+            for name in record.rules:
+                counts[name] += 1
+        return counts
+
+    def _record_matches(self, users):
+        for name, count in self.count_by_rule(users).items():
+            MATCHED_CONNECTIONS.labels(name).set(count)
+
     def get_status_info(self):
-        """获取状态信息"""
-        remote_users = self.get_remote_desktop_users()
+        """获取状态信息 - 读取共享快照, 不会额外扫描"""
+        snapshot = self.get_snapshot()
+        remote_users = snapshot.users.to_dicts()
+        counted = sum(1 for record in snapshot.users if self.is_counted(record))
         return {
             'is_remote_session': self.is_remote_session,
-            'last_check_time': self.last_check_time.isoformat() if self.last_check_time else None,
-            'status_text': f'有 {len(remote_users)} 个外部用户通过远程桌面连接' if self.is_remote_session else '没有外部用户通过远程桌面连接',
+            'raw_is_remote_session': counted > 0,
+            'pending_confirmation': self.debouncer.pending,
+            'last_check_time': snapshot.taken_at.isoformat(),
+            'status_text': f'有 {counted} 个外部用户通过远程桌面连接' if self.is_remote_session else '没有外部用户通过远程桌面连接',
             'remote_users': remote_users,
-            'user_count': len(remote_users)
+            'user_count': len(remote_users),
+            'ignored_count': len(remote_users) - counted,
+            'rules': self.count_by_rule(snapshot.users),
+            'snapshot_version': snapshot.version
         }
 
 # 创建检测器实例
 detector = RemoteDesktopDetector()
 
+# 持久化的连接历史, 在启动服务时创建
+history_store = None
+
+# 集群汇总模式下的代理轮询器
+fleet_collector = None
+
+# 告警分发器, 配置了告警文件时在启动服务时创建
+alert_dispatcher = None
+
+# 后台监控的轮询调度
+scheduler = PollScheduler()
+
+# 状态变化事件广播
+broadcaster = EventBroadcaster()
+_last_published_state = None
+
+def publish_status_if_changed():
+    """确认状态或连接列表变化时向所有 SSE 订阅者广播一次"""
+    global _last_published_state
+    info = detector.get_status_info()
+    state = (info['is_remote_session'], tuple(u['remote_address'] for u in info['remote_users']))
+    if state != _last_published_state:
+        _last_published_state = state
+        broadcaster.publish('status', info)
+
 # 全局变量
 tray_icon = None
 
-# 创建托盘图标
+# 创建托盘图标 (pystray / PIL 只在托盘运行时才导入)
 def create_icon():
+    from PIL import Image, ImageDraw
     # 创建图标
     image = Image.new('RGB', (64, 64), color='blue')
     draw = ImageDraw.Draw(image)
@@ -178,6 +632,7 @@ def create_icon():
 
 def update_tray_icon():
     """更新托盘图标状态"""
+    from PIL import Image, ImageDraw
     if detector.is_remote_session:
         # 有连接时显示红色图标
         image = Image.new('RGB', (64, 64), color='red')
@@ -201,48 +656,151 @@ def show_status():
 def open_web():
     """打开Web界面"""
     import webbrowser
-    webbrowser.open('http://localhost:51472')
+    webbrowser.open(f'http://localhost:{HTTP_PORT}')
+
+def shutdown():
+    """退出前把仍在连接中的会话记为断开, 并写完历史数据库中尚未提交的事件"""
+    if history_store is not None:
+        for event in detector.tracker.close_all(time.time()):
+            history_store.add(event)
+        history_store.close()
 
 def quit_app():
     """退出应用"""
     global tray_icon
     print("正在退出服务...")
+    shutdown()
     if tray_icon:
         tray_icon.stop()
     os._exit(0)
 
-# 创建托盘图标
-tray_icon = pystray.Icon("WhoIsHere", create_icon(), "WhoIsHere - 远程桌面监控")
-tray_icon.menu = pystray.Menu(
-    pystray.MenuItem("状态", show_status),
-    pystray.MenuItem("打开Web界面", open_web),
-    pystray.MenuItem("退出", quit_app)
-)
+def create_tray_icon():
+    """创建托盘图标, 没有图形界面时会抛出异常"""
+    import pystray
+    icon = pystray.Icon("WhoIsHere", create_icon(), "WhoIsHere - 远程桌面监控")
+    icon.menu = pystray.Menu(
+        pystray.MenuItem("状态", show_status),
+        pystray.MenuItem("打开Web界面", open_web),
+        pystray.MenuItem("退出", quit_app)
+    )
+    return icon
+
+@app.before_request
+def _start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def _record_request(response):
+    start = g.get('request_start')
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_DURATION.labels(route, request.method, response.status_code).observe(time.perf_counter() - start)
+    return response
+
+@app.after_request
+def _compress_response(response):
+    """对较大的 JSON/文本响应进行 gzip 压缩 (流式响应除外)"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or 'gzip' not in request.headers.get('Accept-Encoding', '')
+            or response.mimetype not in ('application/json', 'text/html', 'text/plain')):
+        return response
+    data = response.get_data()
+    if len(data) < GZIP_MIN_SIZE:
+        return response
+    response.set_data(gzip.compress(data, compresslevel=6))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
+
+# 静态资源: 原始内容、预先压缩的内容和基于内容哈希的 ETag
+StaticAsset = namedtuple('StaticAsset', ['body', 'gzipped', 'etag', 'mimetype'])
+_assets = {}
+_assets_lock = threading.Lock()
+
+def load_asset(name, mimetype='text/html'):
+    """读取并压缩静态资源, 每个文件只在首次请求时读取一次"""
+    asset = _assets.get(name)
+    if asset is None:
+        with _assets_lock:
+            asset = _assets.get(name)
+            if asset is None:
+                with open(os.path.join(ASSETS_DIR, name), 'rb') as f:
+                    body = f.read()
+                asset = StaticAsset(body, gzip.compress(body, compresslevel=9),
+                                    hashlib.sha256(body).hexdigest()[:16], mimetype)
+                _assets[name] = asset
+    return asset
+
+def serve_asset(name):
+    """从内存返回静态资源, 客户端支持时直接发送预压缩的内容"""
+    asset = load_asset(name)
+    use_gzip = 'gzip' in request.headers.get('Accept-Encoding', '')
+    response = Response(asset.gzipped if use_gzip else asset.body, mimetype=asset.mimetype)
+    if use_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    response.set_etag(f"{asset.etag}-gzip" if use_gzip else asset.etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = ASSET_MAX_AGE
+    return response.make_conditional(request)
+
+def conditional_json(payload, etag, last_modified, snapshot):
+    """返回带 ETag / Last-Modified 的 JSON, 客户端缓存仍有效时返回 304
+
+    ETag 只由数据决定, 并带上进程 epoch, 重启前的 ETag 不会匹配。每次扫描都会变化的
+    检查时间放在 X-Last-Check-Time 头中 (304 响应同样携带, 浏览器会更新缓存的头)。
+    """
+    response = jsonify(payload)
+    response.set_etag(f'{detector.epoch}-{etag}', weak=True)
+    # 快照时间是本地时间 (naive), Werkzeug 会把 naive 时间当作 UTC, 需先标注本地时区
+    response.last_modified = last_modified.astimezone()
+    response.cache_control.no_cache = True
+    response.headers['X-Last-Check-Time'] = snapshot.taken_at.isoformat()
+    return response.make_conditional(request)
+
+def snapshot_etag(snapshot):
+    """连接数据的 ETag 部分; 开启质量采集时 tcp 数据每次扫描都会变化"""
+    if detector.tcp_quality is not None:
+        return f'{snapshot.version}.{snapshot.monotonic:.3f}'
+    return str(snapshot.version)
+
+@app.errorhandler(ScanFailed)
+def _scan_failed(e):
+    return jsonify({'error': f'扫描失败: {e}'}), 503
 
 @app.route('/')
 def index():
     """主页 - 显示状态页面"""
-    return render_template('index.html')
+    return serve_asset('index.html')
 
 @app.route('/api/status')
 def api_status():
-    """API - 获取当前状态"""
-    detector.update_status()
-    return jsonify(detector.get_status_info())
+    """API - 获取当前状态 (读取后台监控发布的快照), 支持条件请求"""
+    info = detector.get_status_info()
+    snapshot = detector.snapshot
+    # 确认状态只在 flips 变化时切换; 待确认状态单独计入
+    etag = f"{info['snapshot_version']}-{detector.debouncer.flips}-{int(info['pending_confirmation'])}"
+    last_modified = max(snapshot.changed_at, detector.status_changed_at or snapshot.changed_at)
+    response = conditional_json(info, etag, last_modified, snapshot)
+    # 轮询间隔每次扫描都会变化, 不放在可缓存的响应体中
+    poll = scheduler.to_dict()
+    response.headers['X-Poll-Interval'] = str(poll['interval_seconds'])
+    response.headers['X-Poll-Reason'] = poll['reason']
+    return response
 
 
 @app.route('/api/force_check')
 def api_force_check():
     """API - 强制检查状态"""
     # 强制重新检测，跳过确认机制
-    current_status = detector.check_remote_desktop_status()
-    current_time = datetime.now()
-    
-    # 直接更新状态，不进行二次确认
-    if current_status != detector.is_remote_session:
-        detector.is_remote_session = current_status
-        detector.last_check_time = current_time
-        print(f"强制更新状态: {'有外部用户远程连接' if current_status else '没有外部用户远程连接'}")
+    seen_change = detector.last_change_version
+    if detector.force_update():
+        print(f"强制更新状态: {'有外部用户远程连接' if detector.is_remote_session else '没有外部用户远程连接'}")
+    publish_status_if_changed()
+    # 连接有变化时唤醒后台监控, 回到最短轮询间隔
+    if detector.last_change_version != seen_change:
+        scheduler.wake()
     
     return jsonify({
         'message': '状态已强制更新',
@@ -251,313 +809,296 @@ def api_force_check():
 
 @app.route('/api/users')
 def api_users():
-    """API - 获取远程桌面连接用户"""
-    users = detector.get_remote_desktop_users()
-    return jsonify({
-        'users': users,
+    """API - 获取远程连接用户, 可用 rule 参数只看某条规则
+
+    带 since=<版本号>&epoch=<epoch> 时只返回该版本之后新增、消失和变化的连接;
+    版本过旧或 epoch 不一致 (服务已重启) 时返回完整列表并标记 full=true。
+    """
+    snapshot = detector.get_snapshot()
+    rule = request.args.get('rule')
+    since = request.args.get('since', type=int)
+    if since is not None and request.args.get('epoch', type=int) == detector.epoch:
+        changes = detector.changes_since(since, snapshot.version)
+        if changes is not None:
+            if rule:
+                changes['added'] = [u for u in changes['added'] if rule in u.rules]
+                changes['modified'] = [u for u in changes['modified'] if rule in u.rules]
+            changes['added'] = detector.serialize(changes['added'])
+            changes['modified'] = detector.serialize(changes['modified'])
+            return conditional_json(dict(
+                changes,
+                full=False,
+                since=since,
+                snapshot_version=snapshot.version,
+                epoch=detector.epoch,
+                timestamp=snapshot.taken_at.isoformat()
+            ), f'{since}-{snapshot_etag(snapshot)}', snapshot.changed_at, snapshot)
+
+    users = list(snapshot.users)
+    if rule:
+        users = [u for u in users if rule in u.rules]
+    by_rule = {name: [] for name in detector.count_by_rule(())}
+    for record in users:
+        for name in record.rules:
+            by_rule[name].append(record.remote_address)
+    return conditional_json({
+        'users': detector.serialize(users),
         'count': len(users),
-        'timestamp': datetime.now().isoformat()
+        'by_rule': {name: {'count': len(addresses), 'remote_addresses': addresses}
+                    for name, addresses in by_rule.items()},
+        'timestamp': snapshot.taken_at.isoformat(),
+        'full': True,
+        'snapshot_version': snapshot.version,
+        'epoch': detector.epoch
+    }, snapshot_etag(snapshot), snapshot.changed_at, snapshot)
+
+@app.route('/api/history')
+def api_history():
+    """API - 连接历史事件 (按时间倒序, 使用 cursor 分页)"""
+    cursor = request.args.get('cursor', type=int)
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+    events, next_cursor = detector.tracker.page(cursor, limit)
+    return jsonify({
+        'events': events,
+        'next_cursor': next_cursor,
+        'active': detector.tracker.active_sessions(time.time())
+    })
+
+@app.route('/api/history/sessions')
+def api_history_sessions():
+    """API - 查询持久化的历史会话, 可按远程IP过滤"""
+    if history_store is None:
+        return jsonify({'error': '未启用历史数据库'}), 503
+    days = request.args.get('days', 30, type=float)
+    limit = min(max(request.args.get('limit', 500, type=int), 1), 5000)
+    sessions = history_store.sessions(request.args.get('ip'), days, limit)
+    return jsonify({'sessions': sessions, 'count': len(sessions)})
+
+@app.route('/api/history/daily')
+def api_history_daily():
+    """API - 按天汇总的连接时长"""
+    if history_store is None:
+        return jsonify({'error': '未启用历史数据库'}), 503
+    days = request.args.get('days', 30, type=float)
+    return jsonify({'days': history_store.daily_totals(days)})
+
+@app.route('/api/fleet')
+def api_fleet():
+    """API - 集群汇总视图 (需以 --fleet 启动)"""
+    if fleet_collector is None:
+        return jsonify({'error': '未启用集群汇总模式'}), 503
+    return jsonify(fleet_collector.view())
+
+@app.route('/api/alerts')
+def api_alerts():
+    """API - 告警分发统计 (需配置 WHOISHERE_ALERTS)"""
+    if alert_dispatcher is None:
+        return jsonify({'error': '未配置告警'}), 503
+    return jsonify(alert_dispatcher.view())
+
+@app.route('/api/health')
+def api_health():
+    """API - 运行状况: 最近一次成功扫描的快照年龄、最近的扫描错误和扫描子进程状态;
+    不健康时返回 503 (扫描失败不会发布快照, 持续失败时快照年龄随之增长)"""
+    snapshot = detector.snapshot
+    age = time.monotonic() - snapshot.monotonic if snapshot else None
+    worker = next((s for s in detector.scanners or () if isinstance(s, WorkerScanner)), None)
+    worker_health = worker.health() if worker is not None else None
+    # 超过两个最长轮询间隔没有成功的扫描, 或扫描子进程不在运行, 视为不健康
+    healthy = (age is not None and age <= max(SNAPSHOT_TTL, 2 * POLL_MAX_INTERVAL)
+               and (worker_health is None or worker_health['alive']))
+    return jsonify({
+        'healthy': healthy,
+        'snapshot_version': snapshot.version if snapshot else None,
+        'snapshot_age_seconds': round(age, 3) if age is not None else None,
+        'last_success_time': snapshot.taken_at.isoformat() if snapshot else None,
+        'last_scan_error': detector.last_scan_error,
+        'last_scan_error_time': detector.last_scan_error_time.isoformat() if detector.last_scan_error_time else None,
+        'consecutive_scan_failures': detector.scan_failures,
+        'scanner': detector.scanner_name,
+        'scan_worker': worker_health,
+        'poll': scheduler.to_dict(),
+    }), 200 if healthy else 503
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus 文本格式的运行指标"""
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
+# 正在推送的 SSE 连接数
+_stream_slots = threading.BoundedSemaphore(STREAM_MAX_CLIENTS)
+
+@app.route('/api/stream')
+def api_stream():
+    """API - 通过 Server-Sent Events 推送状态变化
+
+    同时推送的连接数超过 STREAM_MAX_CLIENTS 时返回 503, 避免占满 Web 线程;
+    每个连接最长持续 STREAM_MAX_AGE 秒, 之后由浏览器带 Last-Event-ID 重连。
+    """
+    if not _stream_slots.acquire(blocking=False):
+        return jsonify({'error': '推送连接数已达上限, 请使用 /api/status 轮询'}), 503
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_id = int(last_event_id)
+    except (TypeError, ValueError):
+        last_id = None
+
+    def generate():
+        cursor = last_id
+        events = broadcaster.events_after(cursor) if cursor is not None else None
+        deadline = time.monotonic() + STREAM_MAX_AGE
+        yield 'retry: 5000\n\n'
+        while time.monotonic() < deadline:
+            if events is None:
+                # 首次连接或续传点过旧, 先发送一次完整的当前状态
+                cursor = broadcaster.last_id
+                data = json.dumps(detector.get_status_info(), ensure_ascii=False)
+                yield f'id: {cursor}\nevent: status\ndata: {data}\n\n'
+            elif not events:
+                yield ': heartbeat\n\n'
+            else:
+                for event_id, event, data in events:
+                    yield f'id: {event_id}\nevent: {event}\ndata: {data}\n\n'
+                    cursor = event_id
+            events = broadcaster.wait(cursor, min(STREAM_HEARTBEAT, max(0, deadline - time.monotonic())))
+
+    response = Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
     })
+    # 连接关闭 (包括生成器还未开始就断开) 时由服务器调用, 释放名额
+    released = threading.Event()
+    def release():
+        if not released.is_set():
+            released.set()
+            _stream_slots.release()
+    response.call_on_close(release)
+    return response
 
 def background_monitor():
-    """后台监控线程"""
+    """后台监控线程 - 轮询间隔由 scheduler 按连接活跃程度自适应调整"""
+    seen_change = detector.last_change_version
     while True:
         try:
-            detector.update_status()
+            pending = detector.update_status()
+            publish_status_if_changed()
             # 更新托盘图标
             if tray_icon:
                 tray_icon.icon = update_tray_icon()
-            time.sleep(30)  # 每30秒检查一次
+            changed = detector.last_change_version != seen_change
+            seen_change = detector.last_change_version
+            scheduler.schedule(active=bool(detector.snapshot and detector.snapshot.users),
+                               changed=changed, pending=pending)
         except Exception as e:
+            # 扫描失败 (ScanFailed) 时状态和快照保持不变, 按出错退避间隔重试
             # 只在前台运行时输出错误
             if not (hasattr(sys, 'frozen') or sys.executable.endswith('pythonw.exe')):
                 print(f"后台监控出错: {e}")
-            time.sleep(10)
+            scheduler.schedule(error=True)
+        scheduler.wait()
+
+def serve_http(server='auto'):
+    """启动 Web 服务: waitress (生产模式, 多线程、长连接) 或 Werkzeug 开发服务器"""
+    if server in ('auto', 'waitress'):
+        try:
+            from waitress import serve
+        except ImportError:
+            if server == 'waitress':
+                raise
+            print("未安装 waitress, 使用 Werkzeug 开发服务器")
+        else:
+            serve(app, host=HTTP_HOST, port=HTTP_PORT, threads=HTTP_THREADS, ident='WhoIsHere')
+            return
+    app.run(host=HTTP_HOST, port=HTTP_PORT, debug=False, threaded=True)
+
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description='WhoIsHere - 远程桌面状态监控')
+    parser.add_argument('--headless', action='store_true',
+                        help='无界面模式: 只运行检测和 Web 接口, 不加载托盘图标 (适合无显示器的服务器)')
+    parser.add_argument('--server', choices=('auto', 'waitress', 'dev'), default='auto',
+                        help='Web 服务器: waitress 为生产模式, dev 为 Werkzeug 开发服务器, auto 优先 waitress')
+    parser.add_argument('--fleet', metavar='FILE', help='集群汇总模式: 轮询文件中列出的代理 (每行一个 host[:port])')
+    parser.add_argument('--fleet-interval', type=float, default=1.0, help='集群轮询间隔(秒)')
+    parser.add_argument('--fleet-timeout', type=float, default=2.0, help='单个代理的请求超时(秒)')
+    return parser.parse_args()
 
 if __name__ == '__main__':
-    # 创建模板目录和文件
-    os.makedirs('templates', exist_ok=True)
+    # 打包后的程序需要先处理扫描子进程的启动
+    multiprocessing.freeze_support()
+    args = parse_args()
     
-    # 创建HTML模板
-    html_template = '''<!DOCTYPE html>
-<html lang="zh-CN">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>远程桌面状态监控</title>
-    <style>
-        body {
-            font-family: 'Microsoft YaHei', Arial, sans-serif;
-            margin: 0;
-            padding: 20px;
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            min-height: 100vh;
-        }
-        .container {
-            max-width: 800px;
-            margin: 0 auto;
-            background: white;
-            border-radius: 10px;
-            box-shadow: 0 10px 30px rgba(0,0,0,0.3);
-            overflow: hidden;
-        }
-        .header {
-            background: #2c3e50;
-            color: white;
-            padding: 20px;
-            text-align: center;
-        }
-        .status-card {
-            padding: 30px;
-            text-align: center;
-        }
-        .status-indicator {
-            width: 100px;
-            height: 100px;
-            border-radius: 50%;
-            margin: 0 auto 20px;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            font-size: 24px;
-            font-weight: bold;
-            color: white;
-            transition: all 0.3s ease;
-        }
-        .status-connected {
-            background: #e74c3c;
-            animation: pulse 2s infinite;
-        }
-        .status-disconnected {
-            background: #27ae60;
-        }
-        @keyframes pulse {
-            0% { transform: scale(1); }
-            50% { transform: scale(1.05); }
-            100% { transform: scale(1); }
-        }
-        .status-text {
-            font-size: 24px;
-            margin: 20px 0;
-            color: #2c3e50;
-        }
-        .last-check {
-            color: #7f8c8d;
-            font-size: 14px;
-        }
-        .history {
-            margin-top: 30px;
-            padding: 20px;
-            background: #f8f9fa;
-            border-radius: 5px;
-        }
-        .history-item {
-            padding: 10px;
-            margin: 5px 0;
-            background: white;
-            border-radius: 5px;
-            border-left: 4px solid #3498db;
-        }
-        .history-time {
-            font-size: 12px;
-            color: #7f8c8d;
-        }
-        .refresh-btn {
-            background: #3498db;
-            color: white;
-            border: none;
-            padding: 10px 20px;
-            border-radius: 5px;
-            cursor: pointer;
-            margin: 10px;
-        }
-        .refresh-btn:hover {
-            background: #2980b9;
-        }
-        .users-section {
-            margin-top: 30px;
-            padding: 20px;
-            background: #f8f9fa;
-            border-radius: 5px;
-        }
-        .user-item {
-            padding: 15px;
-            margin: 10px 0;
-            background: white;
-            border-radius: 8px;
-            border-left: 4px solid #e74c3c;
-            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-        }
-        .user-name {
-            font-size: 18px;
-            font-weight: bold;
-            color: #2c3e50;
-            margin-bottom: 5px;
-        }
-        .user-details {
-            font-size: 14px;
-            color: #7f8c8d;
-            line-height: 1.4;
-        }
-        .user-state {
-            display: inline-block;
-            padding: 2px 8px;
-            border-radius: 12px;
-            font-size: 12px;
-            font-weight: bold;
-            margin-top: 5px;
-        }
-        .state-active {
-            background: #d4edda;
-            color: #155724;
-        }
-        .state-disconnected {
-            background: #f8d7da;
-            color: #721c24;
-        }
-        .no-users {
-            text-align: center;
-            color: #7f8c8d;
-            font-style: italic;
-            padding: 20px;
-        }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <div class="header">
-            <h1>🖥️ 远程桌面状态监控</h1>
-            <p>实时监控远程桌面连接状态</p>
-        </div>
-        
-        <div class="status-card">
-            <div id="statusIndicator" class="status-indicator">
-                <span id="statusIcon">⏳</span>
-            </div>
-            <div id="statusText" class="status-text">检查中...</div>
-            <div id="lastCheck" class="last-check">最后检查: --</div>
-            <button class="refresh-btn" onclick="checkStatus()">🔄 刷新状态</button>
-            <button class="refresh-btn" onclick="forceCheck()" style="background: #e74c3c;">⚡ 强制检查</button>
-        </div>
-        
-        <div class="users-section">
-            <h3>👥 当前远程桌面用户</h3>
-            <div id="usersList">加载中...</div>
-        </div>
-        
-    </div>
-
-    <script>
-        function updateStatus(data) {
-            const indicator = document.getElementById('statusIndicator');
-            const text = document.getElementById('statusText');
-            const lastCheck = document.getElementById('lastCheck');
-            
-            if (data.is_remote_session) {
-                indicator.className = 'status-indicator status-connected';
-                indicator.innerHTML = '🔴';
-                text.textContent = data.status_text || '有用户通过远程桌面连接';
-            } else {
-                indicator.className = 'status-indicator status-disconnected';
-                indicator.innerHTML = '🟢';
-                text.textContent = data.status_text || '没有用户通过远程桌面连接';
-            }
-            
-            if (data.last_check_time) {
-                const time = new Date(data.last_check_time);
-                lastCheck.textContent = `最后检查: ${time.toLocaleString()}`;
-            }
-        }
-        
-        
-        function updateUsers(data) {
-            const usersList = document.getElementById('usersList');
-            if (data.remote_users && data.remote_users.length > 0) {
-                usersList.innerHTML = data.remote_users.map(user => `
-                    <div class="user-item">
-                        <div class="user-name">🌐 ${user.username}</div>
-                        <div class="user-details">
-                            <div><strong>远程IP地址:</strong> ${user.remote_ip || 'Unknown'}</div>
-                            <div><strong>连接状态:</strong> ${user.state}</div>
-                            <div><strong>连接类型:</strong> ${user.connection_type}</div>
-                            ${user.local_address ? `<div><strong>本地地址:</strong> ${user.local_address}</div>` : ''}
-                            ${user.remote_address ? `<div><strong>远程地址:</strong> ${user.remote_address}</div>` : ''}
-                            ${user.process_name ? `<div><strong>进程名称:</strong> ${user.process_name}</div>` : ''}
-                            ${user.session_id ? `<div><strong>会话ID:</strong> ${user.session_id}</div>` : ''}
-                        </div>
-                        <span class="user-state ${user.state.toLowerCase() === 'active' ? 'state-active' : 'state-disconnected'}">
-                            ${user.state}
-                        </span>
-                    </div>
-                `).join('');
-            } else {
-                usersList.innerHTML = '<div class="no-users">当前没有用户通过远程桌面连接</div>';
-            }
-        }
-        
-        async function checkStatus() {
-            try {
-                const response = await fetch('/api/status');
-                const data = await response.json();
-                updateStatus(data);
-                updateUsers(data);
-            } catch (error) {
-                console.error('获取状态失败:', error);
-                document.getElementById('statusText').textContent = '获取状态失败';
-            }
-        }
-        
-        async function forceCheck() {
-            try {
-                document.getElementById('statusText').textContent = '强制检查中...';
-                const response = await fetch('/api/force_check');
-                const data = await response.json();
-                updateStatus(data.status);
-                updateUsers(data.status);
-                console.log('强制检查完成:', data.message);
-            } catch (error) {
-                console.error('强制检查失败:', error);
-                document.getElementById('statusText').textContent = '强制检查失败';
-            }
-        }
-        
-        // 页面加载时检查状态
-        checkStatus();
-        
-        // 每30秒自动刷新
-        setInterval(checkStatus, 30000);
-    </script>
-</body>
-</html>'''
+    # 启动前读取监控规则, 规则文件缺失或格式错误时直接退出
+    try:
+        detector.matcher
+    except Exception as e:
+        print(f"读取监控规则文件 {RULES_FILE} 出错: {e}")
+        sys.exit(1)
+    
+    # 打开连接历史数据库, 连接事件由独立线程批量写入; 无法打开时只保留内存中的历史
+    if HISTORY_DB:
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(HISTORY_DB)), exist_ok=True)
+            history_store = HistoryStore(HISTORY_DB, retention_days=HISTORY_RETENTION_DAYS)
+        except (sqlite3.Error, OSError) as e:
+            print(f"无法打开历史数据库 {HISTORY_DB} ({e})，只在内存中保留连接历史")
+        else:
+            detector.tracker.listeners.append(history_store.add)
+    
+    # 告警: 连接建立/断开和状态切换进入分发队列, 由独立线程发送
+    if ALERTS_FILE:
+        alert_dispatcher = load_alerts(ALERTS_FILE)
+        detector.tracker.listeners.append(alert_dispatcher.add)
+        detector.status_listeners.append(alert_dispatcher.add)
     
-    # 写入HTML模板文件
-    with open('templates/index.html', 'w', encoding='utf-8') as f:
-        f.write(html_template)
+    # 集群汇总模式: 并发轮询所有代理
+    if args.fleet:
+        fleet_collector = FleetCollector(load_agents(args.fleet), interval=args.fleet_interval,
+                                         timeout=args.fleet_timeout)
+        fleet_collector.start()
+    
+    # 服务管理器停止服务 (SIGTERM) 时同样正常退出, 保存仍在连接中的会话
+    signal.signal(signal.SIGTERM, lambda signum, frame: quit_app())
     
     # 启动后台监控线程
     monitor_thread = threading.Thread(target=background_monitor, daemon=True)
     monitor_thread.start()
     
     # 启动Flask应用（在后台线程中）
-    flask_thread = threading.Thread(target=lambda: app.run(host='0.0.0.0', port=51472, debug=False), daemon=True)
+    flask_thread = threading.Thread(target=serve_http, args=(args.server,), daemon=True)
     flask_thread.start()
     
+    # 创建托盘图标; 无界面模式或没有图形界面时不加载 pystray / PIL
+    if not args.headless:
+        try:
+            tray_icon = create_tray_icon()
+        except Exception as e:
+            print(f"无法创建托盘图标 ({e})，以无界面模式运行")
+    
     # 检查是否在后台运行（pythonw）
-    import sys
     if hasattr(sys, 'frozen') or sys.executable.endswith('pythonw.exe'):
         # 后台运行，不输出到控制台
         pass
     else:
         # 前台运行，输出信息
         print("🚀 远程桌面状态监控服务启动中...")
-        print("📱 访问 http://localhost:51472 查看状态")
-        print("💡 服务已最小化到系统托盘，右键图标可查看菜单")
-        print("💡 关闭CMD窗口后服务会继续在托盘运行")
+        print(f"📱 访问 http://localhost:{HTTP_PORT} 查看状态")
+        if tray_icon:
+            print("💡 服务已最小化到系统托盘，右键图标可查看菜单")
+            print("💡 关闭CMD窗口后服务会继续在托盘运行")
+        else:
+            print("💡 无界面模式运行，按 Ctrl+C 停止服务")
     
-    # 启动托盘图标（这会阻塞主线程，保持程序运行）
+    # 启动托盘图标（这会阻塞主线程，保持程序运行）; 无界面模式下等待 Web 服务线程
     try:
-        tray_icon.run()
+        if tray_icon:
+            tray_icon.run()
+        else:
+            while flask_thread.is_alive():
+                flask_thread.join(1)
     except KeyboardInterrupt:
+        shutdown()
         if not (hasattr(sys, 'frozen') or sys.executable.endswith('pythonw.exe')):
             print("服务已停止")
-        tray_icon.stop()
+        if tray_icon:
+            tray_icon.stop()
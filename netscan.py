@@ -0,0 +1,484 @@
+"""网络连接扫描后端
+
+每个扫描器都提供 ``scan(ports, states)`` 方法, 返回本地或远程端口落在
+``ports`` 中、且状态属于 ``states`` 的 TCP 连接列表 (``Connection``),
+并在 ``last_parsed`` 中记录本次扫描解析过的行数/套接字数。
+检测器按顺序尝试扫描器链, 第一个成功的结果即为本次扫描结果,
+``netstat`` 子进程始终作为最后的兜底方案。
+"""
+import os
+import socket
+import shutil
+import struct
+import subprocess
+import sys
+from collections import namedtuple
+
+import psutil
+
+# 扫描得到的单条 TCP 连接; tcp_info 只有开启采集的 netlink 后端会填写
+Connection = namedtuple(
+    'Connection',
+    ['local_ip', 'local_port', 'remote_ip', 'remote_port', 'state', 'pid', 'tcp_info'],
+    defaults=(None,)
+)
+
+# 内核 tcp_info 中用到的字段: 平滑 RTT 与抖动(微秒)、累计重传段数、
+# 已确认发送字节数和已接收字节数 (后两项需要 Linux 4.1+, 否则为 None)
+TcpInfo = namedtuple('TcpInfo', ['rtt', 'rttvar', 'total_retrans', 'bytes_acked', 'bytes_received'])
+
+# /proc/net/tcp 中的十六进制状态码
+PROC_TCP_STATES = {
+    '01': 'ESTABLISHED',
+    '02': 'SYN_SENT',
+    '03': 'SYN_RECV',
+    '04': 'FIN_WAIT1',
+    '05': 'FIN_WAIT2',
+    '06': 'TIME_WAIT',
+    '07': 'CLOSE',
+    '08': 'CLOSE_WAIT',
+    '09': 'LAST_ACK',
+    '0A': 'LISTEN',
+    '0B': 'CLOSING',
+}
+
+# netstat 在不同系统上的状态写法
+NETSTAT_STATE_ALIASES = {
+    'FIN_WAIT_1': 'FIN_WAIT1',
+    'FIN_WAIT_2': 'FIN_WAIT2',
+    'SYN_RECEIVED': 'SYN_RECV',
+    'LISTENING': 'LISTEN',
+    'CLOSED': 'CLOSE',
+}
+
+
+def format_address(ip, port):
+    """把IP和端口格式化为 netstat 风格的地址字符串"""
+    if ':' in ip:
+        return f'[{ip}]:{port}'
+    return f'{ip}:{port}'
+
+
+def split_address(address):
+    """拆分 netstat 地址为 (ip, port), 兼容 [::1]:43389 和 ::1:43389 两种写法"""
+    host, _, port = address.rpartition(':')
+    if host.startswith('[') and host.endswith(']'):
+        host = host[1:-1]
+    host = host.split('%', 1)[0]
+    try:
+        return host, int(port)
+    except ValueError:
+        return host, None
+
+
+class NetstatScanner:
+    """通过 netstat -ano 子进程扫描 (兜底方案)"""
+
+    name = 'netstat'
+    last_parsed = 0
+
+    def available(self):
+        return shutil.which('netstat') is not None
+
+    def scan(self, ports, states):
+        result = subprocess.run(
+            ['netstat', '-ano'],
+            capture_output=True, text=True, timeout=5
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f'netstat 返回码 {result.returncode}')
+        self.last_parsed = result.stdout.count('\n')
+        return self.parse(result.stdout, ports, states)
+
+    @staticmethod
+    def parse(text, ports, states):
+        """解析 netstat -ano 输出, 兼容 Windows 与 Linux 两种列格式"""
+        connections = []
+        for line in text.splitlines():
+            parts = line.split()
+            if len(parts) < 4 or not parts[0].lower().startswith('tcp'):
+                continue
+            if parts[1].isdigit() and parts[2].isdigit():
+                # Linux: Proto Recv-Q Send-Q Local Foreign State ...
+                if len(parts) < 6:
+                    continue
+                local_address, remote_address, state = parts[3], parts[4], parts[5]
+                pid = None
+            else:
+                # Windows: Proto Local Foreign State PID
+                local_address, remote_address, state = parts[1], parts[2], parts[3]
+                pid = int(parts[4]) if len(parts) >= 5 and parts[4].isdigit() else None
+            state = NETSTAT_STATE_ALIASES.get(state, state)
+            if state not in states:
+                continue
+            local_ip, local_port = split_address(local_address)
+            remote_ip, remote_port = split_address(remote_address)
+            if local_port not in ports and remote_port not in ports:
+                continue
+            connections.append(Connection(local_ip, local_port, remote_ip, remote_port, state, pid))
+        return connections
+
+
+class PsutilScanner:
+    """通过 psutil.net_connections 在进程内读取连接表 (Windows / macOS 首选)"""
+
+    name = 'psutil'
+    last_parsed = 0
+
+    def available(self):
+        return True
+
+    def scan(self, ports, states):
+        connections = []
+        table = psutil.net_connections(kind='tcp')
+        self.last_parsed = len(table)
+        for conn in table:
+            if conn.status not in states or not conn.raddr:
+                continue
+            if conn.laddr.port not in ports and conn.raddr.port not in ports:
+                continue
+            connections.append(Connection(
+                conn.laddr.ip, conn.laddr.port,
+                conn.raddr.ip, conn.raddr.port,
+                conn.status, conn.pid
+            ))
+        return connections
+
+
+def _decode_proc_ip(hex_ip):
+    """把 /proc/net/tcp 中按主机字节序存放的十六进制地址转换为IP字符串"""
+    raw = bytes.fromhex(hex_ip)
+    if len(raw) == 4:
+        return socket.inet_ntop(socket.AF_INET, raw[::-1])
+    # IPv6 由4个32位字组成, 每个字内部为小端序
+    raw = b''.join(raw[i:i + 4][::-1] for i in range(0, 16, 4))
+    return _unmap_ipv4(socket.inet_ntop(socket.AF_INET6, raw))
+
+
+def _unmap_ipv4(ip):
+    """把 ::ffff:a.b.c.d 形式的IPv4映射地址还原为IPv4"""
+    if ip.startswith('::ffff:') and '.' in ip:
+        return ip[7:]
+    return ip
+
+
+def find_socket_pids(inodes):
+    """遍历 /proc/*/fd 查找持有指定 socket inode 的进程, 找齐后提前结束"""
+    wanted = {f'socket:[{inode}]': inode for inode in inodes if inode}
+    found = {}
+    if not wanted:
+        return found
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        fd_dir = f'/proc/{pid}/fd'
+        try:
+            fds = os.listdir(fd_dir)
+        except OSError:
+            continue
+        for fd in fds:
+            try:
+                target = os.readlink(f'{fd_dir}/{fd}')
+            except OSError:
+                continue
+            inode = wanted.pop(target, None)
+            if inode is not None:
+                found[inode] = int(pid)
+                if not wanted:
+                    return found
+    return found
+
+
+class SocketOwnerCache:
+    """socket inode -> pid 缓存, 每次扫描只为新出现的 inode 遍历 /proc"""
+
+    def __init__(self):
+        self._owners = {}
+
+    def resolve(self, inodes):
+        inodes = [inode for inode in inodes if inode]
+        missing = [inode for inode in inodes if inode not in self._owners]
+        owners = {inode: self._owners[inode] for inode in inodes if inode in self._owners}
+        if missing:
+            owners.update(find_socket_pids(missing))
+        # 只保留本轮仍存在的 inode, 已关闭的连接随之失效
+        self._owners = owners
+        return owners
+
+
+class ProcNetScanner:
+    """直接解析 /proc/net/tcp 和 /proc/net/tcp6 (Linux)"""
+
+    name = 'proc'
+    paths = ('/proc/net/tcp', '/proc/net/tcp6')
+    last_parsed = 0
+
+    def __init__(self):
+        self._owners = SocketOwnerCache()
+
+    def available(self):
+        return sys.platform.startswith('linux') and os.path.exists(self.paths[0])
+
+    def scan(self, ports, states):
+        rows = []
+        parsed = 0
+        for path in self.paths:
+            try:
+                with open(path, 'r') as f:
+                    text = f.read()
+            except FileNotFoundError:
+                continue
+            parsed += text.count('\n') - 1
+            rows.extend(self.parse(text, ports, states))
+        self.last_parsed = parsed
+        pids = self._owners.resolve(inode for _, inode in rows)
+        return [conn._replace(pid=pids.get(inode)) for conn, inode in rows]
+
+    @staticmethod
+    def parse(text, ports, states):
+        """解析 /proc/net/tcp 表, 先按十六进制端口和状态过滤再解码地址
+
+        返回 (Connection, inode) 列表, pid 留空由调用方补全。
+        """
+        port_hex = {f'{port:04X}' for port in ports}
+        state_hex = {code for code, name in PROC_TCP_STATES.items() if name in states}
+        rows = []
+        lines = text.splitlines()
+        for line in lines[1:]:
+            parts = line.split()
+            if len(parts) < 10 or parts[3] not in state_hex:
+                continue
+            local, remote = parts[1], parts[2]
+            if local[-4:] not in port_hex and remote[-4:] not in port_hex:
+                continue
+            local_ip, local_port = local.split(':')
+            remote_ip, remote_port = remote.split(':')
+            rows.append((
+                Connection(
+                    _decode_proc_ip(local_ip), int(local_port, 16),
+                    _decode_proc_ip(remote_ip), int(remote_port, 16),
+                    PROC_TCP_STATES[parts[3]], None
+                ),
+                int(parts[9])
+            ))
+        return rows
+
+
+# ---- netlink sock_diag ----
+NETLINK_SOCK_DIAG = 4
+SOCK_DIAG_BY_FAMILY = 20
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+NLMSG_ERROR = 0x2
+NLMSG_DONE = 0x3
+INET_DIAG_REQ_BYTECODE = 1
+INET_DIAG_INFO = 2
+
+INET_DIAG_BC_NOP = 0
+INET_DIAG_BC_JMP = 1
+INET_DIAG_BC_S_GE = 2
+INET_DIAG_BC_S_LE = 3
+INET_DIAG_BC_D_GE = 4
+INET_DIAG_BC_D_LE = 5
+
+_NLMSGHDR = struct.Struct('=IHHII')
+_INET_DIAG_REQ_V2 = struct.Struct('=BBBBI')
+_INET_DIAG_MSG = struct.Struct('=BBBB2s2s16s16sIIIIIIII')
+_BC_OP = struct.Struct('=BBH')
+_RTATTR = struct.Struct('=HH')
+# struct tcp_info 中的偏移: tcpi_rtt/tcpi_rttvar @68, tcpi_total_retrans @100,
+# tcpi_bytes_acked/tcpi_bytes_received @120
+_TCP_INFO_RTT = struct.Struct('=II')
+_TCP_INFO_BYTES = struct.Struct('=QQ')
+
+
+def _bc_port(code, port):
+    """单个端口比较: 条件成立跳到末尾(接受), 否则跳到末尾+4(拒绝)"""
+    return [[code, 8, 12], [INET_DIAG_BC_NOP, 0, port]]
+
+
+def _bc_and(a1, a2):
+    """a1 与 a2: 把 a1 中的拒绝跳转延长到整段末尾+4"""
+    a1 = [op[:] for op in a1]
+    remaining = len(a1) * 4
+    i = 0
+    while remaining > 0:
+        op = a1[i]
+        if op[2] == remaining + 4:
+            op[2] += len(a2) * 4
+        remaining -= op[1]
+        i += op[1] // 4
+    return a1 + a2
+
+
+def _bc_or(a1, a2):
+    """a1 或 a2: a1 接受时用 JMP 跳过 a2, a1 拒绝时正好落到 a2 开头"""
+    return a1 + [[INET_DIAG_BC_JMP, 4, len(a2) * 4 + 4]] + a2
+
+
+def build_port_bytecode(ports):
+    """生成 "本地或远程端口属于 ports" 的 inet_diag 过滤字节码 (与 ss 的编码方式一致)"""
+    terms = []
+    for port in sorted(ports):
+        for ge, le in ((INET_DIAG_BC_S_GE, INET_DIAG_BC_S_LE), (INET_DIAG_BC_D_GE, INET_DIAG_BC_D_LE)):
+            terms.append(_bc_and(_bc_port(ge, port), _bc_port(le, port)))
+    bytecode = terms[-1]
+    for term in reversed(terms[:-1]):
+        bytecode = _bc_or(term, bytecode)
+    return b''.join(_BC_OP.pack(*op) for op in bytecode)
+
+
+class NetlinkScanner:
+    """通过 NETLINK_SOCK_DIAG 查询连接, 端口和状态过滤在内核中完成 (Linux)
+
+    扫描开销只与匹配的连接数有关, 与主机连接表的大小无关。
+    """
+
+    name = 'netlink'
+    families = (socket.AF_INET, socket.AF_INET6)
+    last_parsed = 0
+    # 为 True 时同时请求 INET_DIAG_INFO, 在 Connection.tcp_info 中返回 RTT、重传和字节数
+    tcp_info = False
+
+    def __init__(self):
+        self._bytecode_cache = {}
+        self._seq = 0
+        self._owners = SocketOwnerCache()
+
+    def available(self):
+        if not sys.platform.startswith('linux'):
+            return False
+        try:
+            socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_SOCK_DIAG).close()
+        except (AttributeError, OSError):
+            return False
+        return True
+
+    def _build_request(self, family, ports, state_mask):
+        key = frozenset(ports)
+        bytecode = self._bytecode_cache.get(key)
+        if bytecode is None:
+            bytecode = self._bytecode_cache[key] = build_port_bytecode(ports)
+        attr = struct.pack('=HH', 4 + len(bytecode), INET_DIAG_REQ_BYTECODE) + bytecode
+        attr += b'\0' * (-len(attr) % 4)
+        body = (
+            _INET_DIAG_REQ_V2.pack(family, socket.IPPROTO_TCP,
+                                   1 << (INET_DIAG_INFO - 1) if self.tcp_info else 0, 0, state_mask)
+            + bytes(48)
+            + attr
+        )
+        self._seq += 1
+        return _NLMSGHDR.pack(_NLMSGHDR.size + len(body), SOCK_DIAG_BY_FAMILY,
+                              NLM_F_REQUEST | NLM_F_DUMP, self._seq, 0) + body
+
+    def scan(self, ports, states):
+        state_mask = 0
+        for code, name in PROC_TCP_STATES.items():
+            if name in states:
+                state_mask |= 1 << int(code, 16)
+        rows = []
+        with socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_SOCK_DIAG) as sock:
+            for family in self.families:
+                sock.send(self._build_request(family, ports, state_mask))
+                rows.extend(self._receive(sock))
+        # 内核只返回匹配的套接字
+        self.last_parsed = len(rows)
+        pids = self._owners.resolve(inode for _, inode in rows)
+        return [conn._replace(pid=pids.get(inode)) for conn, inode in rows]
+
+    @staticmethod
+    def _receive(sock):
+        rows = []
+        while True:
+            data = sock.recv(262144)
+            offset = 0
+            while offset + _NLMSGHDR.size <= len(data):
+                length, msg_type, _, _, _ = _NLMSGHDR.unpack_from(data, offset)
+                if length < _NLMSGHDR.size:
+                    return rows
+                if msg_type == NLMSG_DONE:
+                    return rows
+                if msg_type == NLMSG_ERROR:
+                    error = struct.unpack_from('=i', data, offset + _NLMSGHDR.size)[0]
+                    raise OSError(-error, os.strerror(-error))
+                if msg_type == SOCK_DIAG_BY_FAMILY:
+                    rows.append(_parse_diag_msg(data, offset + _NLMSGHDR.size, offset + length))
+                offset += (length + 3) & ~3
+
+
+def _parse_diag_msg(data, offset, end=None):
+    """解析 inet_diag_msg 及其后的属性, 返回 (Connection, inode)"""
+    (family, state, _, _, sport, dport, src, dst,
+     _, _, _, _, _, _, _, inode) = _INET_DIAG_MSG.unpack_from(data, offset)
+    if family == socket.AF_INET:
+        local_ip = socket.inet_ntop(socket.AF_INET, src[:4])
+        remote_ip = socket.inet_ntop(socket.AF_INET, dst[:4])
+    else:
+        local_ip = _unmap_ipv4(socket.inet_ntop(socket.AF_INET6, src))
+        remote_ip = _unmap_ipv4(socket.inet_ntop(socket.AF_INET6, dst))
+    return (
+        Connection(
+            local_ip, int.from_bytes(sport, 'big'),
+            remote_ip, int.from_bytes(dport, 'big'),
+            PROC_TCP_STATES.get(f'{state:02X}', str(state)), None,
+            _find_tcp_info(data, offset + _INET_DIAG_MSG.size, end) if end else None
+        ),
+        inode
+    )
+
+
+def _find_tcp_info(data, offset, end):
+    """在 inet_diag_msg 之后的 rtattr 列表中查找并解析 INET_DIAG_INFO"""
+    while offset + _RTATTR.size <= end:
+        length, attr_type = _RTATTR.unpack_from(data, offset)
+        if length < _RTATTR.size:
+            return None
+        if attr_type == INET_DIAG_INFO:
+            return parse_tcp_info(data[offset + _RTATTR.size:offset + length])
+        offset += (length + 3) & ~3
+    return None
+
+
+def parse_tcp_info(payload):
+    """从 struct tcp_info 中取出 TcpInfo, 较旧内核缺少的字段为 None"""
+    if len(payload) < 104:
+        return None
+    rtt, rttvar = _TCP_INFO_RTT.unpack_from(payload, 68)
+    total_retrans = struct.unpack_from('=I', payload, 100)[0]
+    bytes_acked = bytes_received = None
+    if len(payload) >= 136:
+        bytes_acked, bytes_received = _TCP_INFO_BYTES.unpack_from(payload, 120)
+    return TcpInfo(rtt, rttvar, total_retrans, bytes_acked, bytes_received)
+
+
+SCANNER_TYPES = {
+    'netlink': NetlinkScanner,
+    'proc': ProcNetScanner,
+    'psutil': PsutilScanner,
+    'netstat': NetstatScanner,
+}
+
+# auto 模式下的优先级, netstat 总是兜底
+AUTO_ORDER = ('netlink', 'proc', 'psutil', 'netstat')
+
+
+def build_scanner_chain(preferred='auto', tcp_info=False):
+    """按配置构建扫描器链, 不可用的后端会被跳过, netstat 始终排在最后
+
+    tcp_info 为 True 时让支持的后端 (netlink) 同时采集 tcp_info。
+    """
+    names = AUTO_ORDER if preferred == 'auto' else (preferred, 'netstat')
+    chain = []
+    for name in names:
+        scanner_type = SCANNER_TYPES.get(name)
+        if scanner_type is None:
+            print(f"未知的扫描后端: {name}")
+            continue
+        scanner = scanner_type()
+        if tcp_info and hasattr(scanner, 'tcp_info'):
+            scanner.tcp_info = True
+        if scanner.available() and all(s.name != name for s in chain):
+            chain.append(scanner)
+    if not chain:
+        chain.append(NetstatScanner())
+    return chain
@@ -0,0 +1,89 @@
+"""进程信息缓存
+
+以 (pid, 进程创建时间) 为键缓存进程名、可执行文件、所属用户和启动时间,
+PID 被复用时创建时间不同, 不会误用旧进程的信息。
+
+同一个连接在相邻两次扫描中属于同一 pid 时直接复用缓存, 不做任何系统调用;
+新出现的连接只需读取一次创建时间, 只有新进程才需要完整查询。长期运行的进程
+即使连接断开后又重新连接, 也仍然命中缓存。因此开销与新出现的进程数成正比,
+与扫描次数无关。缓存项只在 LRU 淘汰、进程已退出 (NoSuchProcess) 或同一 pid
+的创建时间变化 (pid 被复用) 时失效。
+"""
+from collections import OrderedDict
+from datetime import datetime
+
+import psutil
+
+
+class ProcessInfoCache:
+    """带 LRU 淘汰的进程信息缓存"""
+
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # (pid, 连接标识) -> (pid, 创建时间), 上一轮扫描与本轮扫描各一份
+        self._trusted = {}
+        self._current = {}
+
+    def lookup(self, pid, connection):
+        """返回 pid 对应的进程信息字典, 进程不存在时返回 None"""
+        token = (pid, connection)
+        key = self._trusted.get(token)
+        if key is not None and key in self._entries:
+            # 连接仍由同一 pid 持有, 进程不可能已退出并被复用
+            self._entries.move_to_end(key)
+            self._current[token] = key
+            self.hits += 1
+            return self._entries[key]
+
+        try:
+            process = psutil.Process(pid)
+            key = (pid, process.create_time())
+        except psutil.NoSuchProcess:
+            self._forget_pid(pid)
+            return None
+        except (psutil.Error, ValueError, OSError):
+            return None
+
+        info = self._entries.get(key)
+        if info is None:
+            self.misses += 1
+            # 同一 pid 的旧条目属于已退出的进程 (pid 被复用)
+            self._forget_pid(pid)
+            info = self._describe(process)
+            self._entries[key] = info
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+        else:
+            self.hits += 1
+            self._entries.move_to_end(key)
+        self._current[token] = key
+        return info
+
+    def end_scan(self):
+        """一轮扫描结束: 本轮出现的连接成为下一轮可以免检查复用的连接 (缓存项本身保留)"""
+        self._trusted = self._current
+        self._current = {}
+
+    def _forget_pid(self, pid):
+        for key in [k for k in self._entries if k[0] == pid]:
+            del self._entries[key]
+
+    @staticmethod
+    def _describe(process):
+        info = {}
+        with process.oneshot():
+            for field, getter in (('process_name', process.name),
+                                  ('exe', process.exe),
+                                  ('process_user', process.username)):
+                try:
+                    info[field] = getter()
+                except (psutil.Error, OSError):
+                    info[field] = 'Unknown' if field == 'process_name' else None
+            try:
+                info['process_start_time'] = datetime.fromtimestamp(process.create_time()).isoformat()
+            except (psutil.Error, OSError):
+                info['process_start_time'] = None
+        return info
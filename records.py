@@ -0,0 +1,131 @@
+"""连接记录
+
+扫描命中的每条连接保存为一个 ``ConnectionRecord`` (使用 __slots__, 地址经 ipaddress 解析
+和规范化), 一次扫描的所有记录放在按连接标识 (远程IP, 远程端口, 本地端口) 索引的
+``ConnectionTable`` 中, 去重和按连接查找都是 O(1)。记录在首次输出 JSON 时才转换为字典,
+转换结果随记录缓存, 同一快照被多个接口读取时不会重复构建。
+"""
+import ipaddress
+from functools import lru_cache
+
+from netscan import format_address
+
+
+@lru_cache(maxsize=65536)
+def parse_ip(text):
+    """解析并规范化 IP: 去掉 zone id, IPv4 映射的 IPv6 地址还原为 IPv4; 无法解析时原样返回"""
+    try:
+        address = ipaddress.ip_address(text.split('%', 1)[0])
+    except ValueError:
+        return text
+    return getattr(address, 'ipv4_mapped', None) or address
+
+
+class ConnectionRecord:
+    """一条命中监控规则的连接, 加入快照后不再修改"""
+
+    __slots__ = ('local_ip', 'local_port', 'remote_ip', 'remote_port', 'state', 'pid',
+                 'rules', 'process', 'label', 'key', '_dict')
+
+    def __init__(self, local_ip, local_port, remote_ip, remote_port, state, pid=None, rules=(), process=None,
+                 label=None):
+        self.local_ip = parse_ip(local_ip)
+        self.local_port = local_port
+        self.remote_ip = parse_ip(remote_ip)
+        self.remote_port = remote_port
+        self.state = state
+        self.pid = pid
+        # 命中的规则名称, 第一条为主规则
+        self.rules = tuple(rules)
+        # 进程信息字典 (由 ProcessInfoCache 共享), 未知时为 None
+        self.process = process
+        # 远程IP的分类标签 (见 ipclass.py), 未启用分类时为 None
+        self.label = label
+        self.key = (str(self.remote_ip), remote_port, local_port)
+        self._dict = None
+
+    @classmethod
+    def from_connection(cls, conn, rules, process=None):
+        return cls(conn.local_ip, conn.local_port, conn.remote_ip, conn.remote_port,
+                   conn.state, conn.pid, [rule.name for rule in rules], process)
+
+    @property
+    def remote_address(self):
+        return format_address(self.key[0], self.remote_port)
+
+    @property
+    def local_address(self):
+        return format_address(str(self.local_ip), self.local_port)
+
+    def _values(self):
+        return (self.local_ip, self.local_port, self.remote_ip, self.remote_port,
+                self.state, self.pid, self.rules, self.process, self.label)
+
+    def __eq__(self, other):
+        if not isinstance(other, ConnectionRecord):
+            return NotImplemented
+        return self._values() == other._values()
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f'ConnectionRecord({self.local_address} <- {self.remote_address} {self.state} pid={self.pid})'
+
+    def to_dict(self):
+        """接口输出的用户信息字典 (首次调用时构建并缓存, 调用方不得修改)"""
+        if self._dict is None:
+            remote_ip = self.key[0]
+            user = {
+                'username': f'Remote Connection from {remote_ip}',
+                'session_name': f'{self.rules[0]} Connection' if self.rules else 'Connection',
+                'session_id': str(self.pid) if self.pid else 'Network',
+                'state': 'Active' if self.state == 'ESTABLISHED' else self.state,
+                'connection_type': self.rules[0] if self.rules else None,
+                'rules': list(self.rules),
+                'remote_ip': remote_ip,
+                'remote_port': self.remote_port,
+                'local_port': self.local_port,
+                'local_address': self.local_address,
+                'remote_address': self.remote_address,
+                'ip_label': self.label,
+            }
+            if self.process:
+                user.update(self.process)
+            self._dict = user
+        return self._dict
+
+
+class ConnectionTable:
+    """一次扫描的连接记录, 按连接标识索引并保持扫描顺序; 同一标识只保留第一条"""
+
+    __slots__ = ('_records',)
+
+    def __init__(self, records=()):
+        self._records = {}
+        for record in records:
+            self.add(record)
+
+    def add(self, record):
+        """加入一条记录, 标识已存在时忽略并返回 False"""
+        if record.key in self._records:
+            return False
+        self._records[record.key] = record
+        return True
+
+    def get(self, key):
+        return self._records.get(key)
+
+    def keys(self):
+        return self._records.keys()
+
+    def __iter__(self):
+        return iter(self._records.values())
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, key):
+        return key in self._records
+
+    def to_dicts(self):
+        return [record.to_dict() for record in self._records.values()]
@@ -0,0 +1,65 @@
+"""监控规则
+
+每条规则包含名称、端口集合、匹配方向 (本地端口 / 远程端口 / 任意一侧) 和 TCP 状态。
+所有规则编译为按端口索引的哈希表, 一次扫描即可把每个连接归类到所有规则。
+"""
+import json
+
+SIDES = ('local', 'remote', 'any')
+
+
+class WatchRule:
+    """命名的监控规则"""
+
+    def __init__(self, name, ports, side='any', states=('ESTABLISHED',)):
+        if side not in SIDES:
+            raise ValueError(f'规则 {name} 的 side 必须是 {"/".join(SIDES)} 之一: {side}')
+        self.name = name
+        self.ports = frozenset(int(p) for p in ports)
+        self.side = side
+        self.states = frozenset(states)
+
+    def __repr__(self):
+        return f'WatchRule({self.name!r}, {sorted(self.ports)}, side={self.side!r})'
+
+
+def load_rules(path):
+    """从 JSON 文件读取规则列表, 格式:
+    [{"name": "SSH", "ports": [22], "side": "local", "states": ["ESTABLISHED"]}, ...]
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        items = json.load(f)
+    return [WatchRule(item['name'], item['ports'], item.get('side', 'any'),
+                      item.get('states', ('ESTABLISHED',)))
+            for item in items]
+
+
+class RuleMatcher:
+    """把规则编译为 本地端口 -> 规则 / 远程端口 -> 规则 两张哈希表"""
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.ports = frozenset().union(*(r.ports for r in self.rules))
+        self.states = frozenset().union(*(r.states for r in self.rules))
+        self._local = {}
+        self._remote = {}
+        for rule in self.rules:
+            for port in rule.ports:
+                if rule.side in ('local', 'any'):
+                    self._local.setdefault(port, []).append(rule)
+                if rule.side in ('remote', 'any'):
+                    self._remote.setdefault(port, []).append(rule)
+
+    def match(self, conn):
+        """返回连接命中的规则列表 (按规则定义顺序, 不重复)"""
+        local = self._local.get(conn.local_port, ())
+        remote = self._remote.get(conn.remote_port, ())
+        if not local and not remote:
+            return []
+        matched = [r for r in local if conn.state in r.states]
+        for rule in remote:
+            if conn.state in rule.states and rule not in matched:
+                matched.append(rule)
+        if local and remote:
+            matched.sort(key=self.rules.index)
+        return matched
@@ -0,0 +1,250 @@
+"""独立的扫描子进程
+
+扫描器链 (解析连接表、查找套接字所属进程) 运行在一个受监管的子进程中,
+Web 进程只发送扫描请求并读取结果, 慢扫描不会和接口请求争抢 GIL,
+扫描崩溃也不会拖垮主进程。
+
+请求和结果通过 Pipe 以紧凑的二进制格式传输 (struct 打包, 不使用 pickle):
+
+- 请求: 头部 (序号, 是否采集 tcp_info, 端口数, 状态数), 端口数组, 以 \\0 分隔的状态名
+- 结果: 头部 (序号, 是否出错, 连接数, 解析行数, 扫描耗时), 后端名称, 然后逐条连接:
+  状态在请求状态列表中的下标、地址族、本地/远程地址 (4 或 16 字节, 无法解析的地址
+  以长度前缀的文本表示)、端口、pid, 可选的 tcp_info
+
+``WorkerScanner`` 本身实现扫描器接口, 可以直接放进检测器的扫描器链。
+子进程退出或单次扫描超过 timeout 秒时, 监管方终止并重启子进程。
+"""
+import multiprocessing
+import socket
+import struct
+import threading
+import time
+
+from netscan import Connection, TcpInfo, build_scanner_chain
+
+_REQUEST = struct.Struct('=IBHH')
+_RESPONSE = struct.Struct('=IBIId')
+_RECORD = struct.Struct('=BHHI')
+_TCP_INFO = struct.Struct('=IIIQQ')
+_NO_PID = 0
+_NO_COUNTER = 2 ** 64 - 1
+_FAMILY_TEXT = 0
+
+_FLAG_TCP_INFO = 1
+_RECORD_HAS_TCP_INFO = 0x80
+
+
+def encode_request(seq, ports, states, tcp_info=False):
+    ports = sorted(ports)
+    states = list(states)
+    return (_REQUEST.pack(seq, _FLAG_TCP_INFO if tcp_info else 0, len(ports), len(states))
+            + struct.pack(f'={len(ports)}H', *ports)
+            + '\0'.join(states).encode('ascii'))
+
+
+def decode_request(data):
+    seq, flags, port_count, state_count = _REQUEST.unpack_from(data)
+    offset = _REQUEST.size
+    ports = frozenset(struct.unpack_from(f'={port_count}H', data, offset))
+    offset += port_count * 2
+    states = tuple(data[offset:].decode('ascii').split('\0')) if state_count else ()
+    return seq, bool(flags & _FLAG_TCP_INFO), ports, states
+
+
+def _pack_ip(ip):
+    for family, size in ((socket.AF_INET, 4), (socket.AF_INET6, 16)):
+        try:
+            return bytes((size,)) + socket.inet_pton(family, ip)
+        except (OSError, ValueError):
+            continue
+    text = ip.encode('utf-8')[:255]
+    return bytes((_FAMILY_TEXT,)) + bytes((len(text),)) + text
+
+
+def _unpack_ip(data, offset):
+    size = data[offset]
+    if size == 4:
+        return socket.inet_ntop(socket.AF_INET, data[offset + 1:offset + 5]), offset + 5
+    if size == 16:
+        return socket.inet_ntop(socket.AF_INET6, data[offset + 1:offset + 17]), offset + 17
+    length = data[offset + 1]
+    return data[offset + 2:offset + 2 + length].decode('utf-8'), offset + 2 + length
+
+
+def encode_response(seq, backend, parsed, seconds, connections, states):
+    state_index = {state: i for i, state in enumerate(states)}
+    name = backend.encode('utf-8')
+    parts = [_RESPONSE.pack(seq, 0, len(connections), parsed, seconds), bytes((len(name),)), name]
+    for conn in connections:
+        info = conn.tcp_info
+        flags = state_index.get(conn.state, 0x7F) | (_RECORD_HAS_TCP_INFO if info is not None else 0)
+        parts.append(_RECORD.pack(flags, conn.local_port, conn.remote_port, conn.pid or _NO_PID))
+        parts.append(_pack_ip(conn.local_ip))
+        parts.append(_pack_ip(conn.remote_ip))
+        if info is not None:
+            parts.append(_TCP_INFO.pack(
+                info.rtt, info.rttvar, info.total_retrans,
+                _NO_COUNTER if info.bytes_acked is None else info.bytes_acked,
+                _NO_COUNTER if info.bytes_received is None else info.bytes_received))
+    return b''.join(parts)
+
+
+def encode_error(seq, message):
+    return _RESPONSE.pack(seq, 1, 0, 0, 0.0) + message.encode('utf-8')
+
+
+def decode_response(data, states):
+    """返回 (序号, 后端名称, 解析行数, 扫描耗时, 连接列表); 子进程报告错误时抛出 RuntimeError"""
+    seq, error, count, parsed, seconds = _RESPONSE.unpack_from(data)
+    offset = _RESPONSE.size
+    if error:
+        raise RuntimeError(data[offset:].decode('utf-8', 'replace'))
+    length = data[offset]
+    backend = data[offset + 1:offset + 1 + length].decode('utf-8')
+    offset += 1 + length
+    connections = []
+    for _ in range(count):
+        flags, local_port, remote_port, pid = _RECORD.unpack_from(data, offset)
+        offset += _RECORD.size
+        local_ip, offset = _unpack_ip(data, offset)
+        remote_ip, offset = _unpack_ip(data, offset)
+        info = None
+        if flags & _RECORD_HAS_TCP_INFO:
+            rtt, rttvar, retrans, acked, received = _TCP_INFO.unpack_from(data, offset)
+            offset += _TCP_INFO.size
+            info = TcpInfo(rtt, rttvar, retrans,
+                           None if acked == _NO_COUNTER else acked,
+                           None if received == _NO_COUNTER else received)
+        index = flags & 0x7F
+        connections.append(Connection(local_ip, local_port, remote_ip, remote_port,
+                                      states[index] if index < len(states) else 'UNKNOWN',
+                                      pid or None, info))
+    return seq, backend, parsed, seconds, connections
+
+
+def worker_main(conn, backend):
+    """子进程入口: 循环接收扫描请求, 依次尝试扫描器链, 返回第一个成功后端的结果"""
+    scanners = build_scanner_chain(backend)
+    while True:
+        try:
+            request = conn.recv_bytes()
+        except (EOFError, OSError):
+            # 监管进程已退出
+            return
+        seq, tcp_info, ports, states = decode_request(request)
+        errors = []
+        response = None
+        for scanner in scanners:
+            if hasattr(scanner, 'tcp_info'):
+                scanner.tcp_info = tcp_info
+            start = time.perf_counter()
+            try:
+                connections = scanner.scan(ports, states)
+            except Exception as e:
+                errors.append(f'{scanner.name}: {e}')
+                continue
+            response = encode_response(seq, scanner.name, scanner.last_parsed,
+                                       time.perf_counter() - start, connections, states)
+            break
+        if response is None:
+            response = encode_error(seq, '所有扫描后端均不可用 (' + '; '.join(errors) + ')')
+        conn.send_bytes(response)
+
+
+class WorkerScanner:
+    """在受监管的子进程中运行扫描器链; 子进程崩溃或扫描超时时自动重启"""
+
+    name = 'worker'
+    last_parsed = 0
+
+    def __init__(self, backend='auto', timeout=30.0, tcp_info=False):
+        self.backend = backend
+        self.timeout = timeout
+        self.tcp_info = tcp_info
+        self.restarts = 0
+        self.backend_name = None
+        self.last_error = None
+        self.last_ok = None
+        self.last_scan_seconds = None
+        self.started_at = None
+        self._context = multiprocessing.get_context('spawn')
+        self._process = None
+        self._conn = None
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def available(self):
+        return True
+
+    def _start(self):
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(target=worker_main, args=(child_conn, self.backend),
+                                        name='whoishere-scanner', daemon=True)
+        process.start()
+        child_conn.close()
+        self._process, self._conn = process, parent_conn
+        self.started_at = time.time()
+
+    def _stop(self):
+        if self._conn is not None:
+            self._conn.close()
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join(1)
+            if self._process.is_alive():
+                self._process.kill()
+                self._process.join(1)
+        self._process = self._conn = None
+
+    def _restart(self, reason):
+        print(f"扫描子进程{reason}, 正在重启")
+        self.last_error = reason
+        self.restarts += 1
+        self._stop()
+        self._start()
+
+    def scan(self, ports, states):
+        states = tuple(states)
+        with self._lock:
+            if self._process is None:
+                self._start()
+            elif not self._process.is_alive():
+                self._restart(f'已退出 (退出码 {self._process.exitcode})')
+            self._seq += 1
+            start = time.monotonic()
+            try:
+                self._conn.send_bytes(encode_request(self._seq, ports, states, self.tcp_info))
+                data = self._conn.recv_bytes() if self._conn.poll(self.timeout) else None
+            except (EOFError, OSError) as e:
+                self._restart(f'通信失败 ({e or e.__class__.__name__})')
+                raise RuntimeError('扫描子进程已退出') from None
+            if data is None:
+                self._restart(f'扫描超过 {self.timeout} 秒无响应')
+                raise TimeoutError('扫描子进程无响应')
+            seq, backend, parsed, _, connections = decode_response(data, states)
+            if seq != self._seq:
+                self._restart('返回了过期的结果')
+                raise RuntimeError('扫描子进程返回了过期的结果')
+            self.backend_name = backend
+            self.last_parsed = parsed
+            self.last_ok = time.time()
+            self.last_scan_seconds = time.monotonic() - start
+            return connections
+
+    def close(self):
+        with self._lock:
+            self._stop()
+
+    def health(self):
+        """子进程的运行状态"""
+        process = self._process
+        return {
+            'alive': process is not None and process.is_alive(),
+            'pid': process.pid if process is not None else None,
+            'backend': self.backend_name,
+            'restarts': self.restarts,
+            'last_error': self.last_error,
+            'uptime_seconds': round(time.time() - self.started_at, 1) if self.started_at else None,
+            'last_ok_age_seconds': round(time.time() - self.last_ok, 3) if self.last_ok else None,
+            'last_scan_ms': round(self.last_scan_seconds * 1000, 3) if self.last_scan_seconds is not None else None,
+        }
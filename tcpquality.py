@@ -0,0 +1,85 @@
+"""连接质量跟踪
+
+根据每次扫描读到的内核 tcp_info 计算每个会话的平滑 RTT、重传次数以及
+两次扫描之间的发送/接收速率, 并为每个会话保留一段定长的时间序列。
+序列中每个点是一个元组, 只在输出接口时才转换为列表。
+"""
+from collections import deque
+
+# 时间序列中每个点的字段
+SERIES_FIELDS = ('time', 'rtt_ms', 'send_bps', 'recv_bps', 'retransmits')
+
+
+def _rate(current, previous, elapsed):
+    """两次计数之差除以间隔; 计数缺失或回绕 (套接字被复用) 时返回 None"""
+    if current is None or previous is None or elapsed <= 0 or current < previous:
+        return None
+    return round((current - previous) / elapsed, 1)
+
+
+class SessionQuality:
+    """单个会话的最近一次采样和时间序列"""
+
+    __slots__ = ('info', 'sampled_at', 'send_bps', 'recv_bps', 'retransmits', 'series')
+
+    def __init__(self, history):
+        self.info = None
+        self.sampled_at = None
+        self.send_bps = None
+        self.recv_bps = None
+        self.retransmits = 0
+        self.series = deque(maxlen=history)
+
+    def sample(self, info, now):
+        previous, previous_at = self.info, self.sampled_at
+        if previous is not None:
+            elapsed = now - previous_at
+            self.send_bps = _rate(info.bytes_acked, previous.bytes_acked, elapsed)
+            self.recv_bps = _rate(info.bytes_received, previous.bytes_received, elapsed)
+            self.retransmits = max(0, info.total_retrans - previous.total_retrans)
+        self.info = info
+        self.sampled_at = now
+        self.series.append((round(now, 3), round(info.rtt / 1000, 3),
+                            self.send_bps, self.recv_bps, self.retransmits))
+
+    def to_dict(self):
+        info = self.info
+        return {
+            'rtt_ms': round(info.rtt / 1000, 3),
+            'rttvar_ms': round(info.rttvar / 1000, 3),
+            'total_retransmits': info.total_retrans,
+            'retransmits': self.retransmits,
+            'bytes_sent': info.bytes_acked,
+            'bytes_received': info.bytes_received,
+            'send_bps': self.send_bps,
+            'recv_bps': self.recv_bps,
+            'series_fields': SERIES_FIELDS,
+            'series': [list(point) for point in tuple(self.series)],
+        }
+
+
+class TcpQualityTracker:
+    """按连接标识保存各会话的质量数据, 连接消失后随下一轮扫描丢弃"""
+
+    def __init__(self, history=60):
+        self.history = history
+        self._sessions = {}
+        self._seen = set()
+
+    def observe(self, key, info, now):
+        session = self._sessions.get(key)
+        if session is None:
+            session = self._sessions[key] = SessionQuality(self.history)
+        session.sample(info, now)
+        self._seen.add(key)
+
+    def end_scan(self):
+        """一轮扫描结束: 丢弃本轮没有出现的会话"""
+        for key in self._sessions.keys() - self._seen:
+            del self._sessions[key]
+        self._seen = set()
+
+    def get(self, key):
+        """返回会话的质量数据字典, 没有采样时返回 None"""
+        session = self._sessions.get(key)
+        return session.to_dict() if session is not None else None